@@ -7,59 +7,193 @@ Hierarchical Agent Teams – 官方教程完整可运行代码
 
 import os
 import asyncio
+import functools
+import hashlib
+import json
+import logging
+import operator
+import re
+import sys
 import time
 from typing import List, Annotated, Dict, Optional, Literal, Any
 from typing_extensions import TypedDict
-from datetime import datetime
-
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, MessagesState, START, END
-from langgraph.types import Command
+from datetime import datetime, timezone
+from types import MappingProxyType
+from collections import Counter, OrderedDict
+from array import array
+
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.messages import AnyMessage, BaseMessage, HumanMessage
+from langgraph.graph import StateGraph, MessagesState, START, END, add_messages
+from langgraph.types import Command, Send
 from langchain_core.tools import tool
 
+from timeutil import now_iso
+
+
+logger = logging.getLogger(__name__)
+
 
 # ------------------------------------------------------------------
 # 执行追踪系统
 # ------------------------------------------------------------------
 
 class ExecutionTrace:
-    """执行追踪类，用于记录调度决策和执行过程"""
+    """
+    执行追踪类，用于记录调度决策和执行过程
+
+    按列存储（每个字段一个列表，时间戳为 int64 纳秒数组），
+    追加记录时不创建字典，只在序列化时格式化时间戳。
+    """
+
+    __slots__ = (
+        "supervisors", "decision_names", "reasons", "decision_ts",
+        "event_types", "event_agents", "event_messages", "event_ts",
+        "current_phase",
+    )
 
     def __init__(self):
-        self.decisions = []  # 调度决策记录
-        self.timeline = []   # 执行时间线
+        # 调度决策记录
+        self.supervisors: List[str] = []
+        self.decision_names: List[str] = []
+        self.reasons: List[str] = []
+        self.decision_ts = array("q")
+        # 执行时间线
+        self.event_types: List[str] = []
+        self.event_agents: List[str] = []
+        self.event_messages: List[str] = []
+        self.event_ts = array("q")
         self.current_phase = None
 
+    @staticmethod
+    def _format_ts(ts_ns: int) -> str:
+        return datetime.fromtimestamp(ts_ns / 1e9, timezone.utc).isoformat(timespec="milliseconds")
+
     def add_decision(self, supervisor: str, decision: str, reason: str = ""):
         """添加调度决策"""
-        self.decisions.append({
-            "supervisor": supervisor,
-            "decision": decision,
-            "reason": reason,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.supervisors.append(supervisor)
+        self.decision_names.append(decision)
+        self.reasons.append(reason)
+        self.decision_ts.append(time.time_ns())
 
     def add_timeline_event(self, event_type: str, agent: str, message: str):
         """添加时间线事件"""
-        self.timeline.append({
-            "type": event_type,
-            "agent": agent,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.event_types.append(event_type)
+        self.event_agents.append(agent)
+        self.event_messages.append(message)
+        self.event_ts.append(time.time_ns())
+
+    @property
+    def decisions(self) -> List[Dict[str, str]]:
+        """调度决策记录（序列化视图）"""
+        return [
+            {"supervisor": sup, "decision": dec, "reason": reason, "timestamp": self._format_ts(ts)}
+            for sup, dec, reason, ts in zip(self.supervisors, self.decision_names, self.reasons, self.decision_ts)
+        ]
+
+    @property
+    def timeline(self) -> List[Dict[str, str]]:
+        """执行时间线（序列化视图）"""
+        return [
+            {"type": event_type, "agent": agent, "message": message, "timestamp": self._format_ts(ts)}
+            for event_type, agent, message, ts in zip(self.event_types, self.event_agents, self.event_messages, self.event_ts)
+        ]
 
     def get_summary(self) -> str:
         """获取执行摘要"""
-        if not self.decisions:
+        if not self.supervisors:
             return "无调度决策记录"
 
-        summary_lines = ["调度决策摘要："]
-        for i, decision in enumerate(self.decisions, 1):
-            reason = f" - {decision['reason']}" if decision['reason'] else ""
-            summary_lines.append(f"{i}. {decision['supervisor']} → {decision['decision']}{reason}")
+        return "调度决策摘要：\n" + "\n".join(
+            f"{i}. {sup} → {dec}{' - ' + reason if reason else ''}"
+            for i, (sup, dec, reason) in enumerate(zip(self.supervisors, self.decision_names, self.reasons), 1)
+        )
+
+
+class _StreamBatcher:
+    """流式输出批处理：按节点分别合并 result 帧，减少下游 SSE 帧数"""
+
+    def __init__(self, max_chunks: int = 8, max_interval: float = 0.05):
+        self.max_chunks = max_chunks      # 单个节点单批最多合并的 result 帧数
+        self.max_interval = max_interval  # 单批最长等待时间（秒）
 
-        return "\n".join(summary_lines)
+    @staticmethod
+    def _merge(buffer: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """按顺序拼接缓冲区中的 result 帧"""
+        return {
+            **buffer[0],
+            "message": "".join(frame["message"] for frame in buffer),
+            "timestamp": buffer[-1]["timestamp"]
+        }
+
+    async def batch(self, frames):
+        """
+        批量输出帧
+
+        result 帧按节点分别缓冲（并行分支的 token 交错到达时仍能合并），
+        某节点攒满 max_chunks 帧即输出该节点，时间窗口结束时输出全部缓冲；
+        其余类型的帧立即输出（先输出全部已缓冲的 result 帧，保证顺序）
+
+        Args:
+            frames: 原始帧的异步迭代器
+
+        Yields:
+            Dict: 合并后的帧
+        """
+        loop = asyncio.get_running_loop()
+        iterator = frames.__aiter__()
+        buffers: Dict[Any, List[Dict[str, Any]]] = {}
+        deadline = 0.0
+        pending = None
+
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(anext(iterator))
+
+                # 有缓冲时最多等到时间窗口结束，超时即输出
+                timeout = max(0.0, deadline - loop.time()) if buffers else None
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    for buffer in buffers.values():
+                        yield self._merge(buffer)
+                    buffers.clear()
+                    continue
+
+                task, pending = pending, None
+                try:
+                    frame = task.result()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    # 上游出错前先输出已缓冲的内容
+                    for buffer in buffers.values():
+                        yield self._merge(buffer)
+                    raise
+
+                if frame.get("type") == "result":
+                    if not buffers:
+                        deadline = loop.time() + self.max_interval
+                    node = frame.get("node")
+                    buffer = buffers.setdefault(node, [])
+                    buffer.append(frame)
+                    if len(buffer) >= self.max_chunks:
+                        yield self._merge(buffers.pop(node))
+                    continue
+
+                for buffer in buffers.values():
+                    yield self._merge(buffer)
+                buffers.clear()
+                yield frame
+
+            for buffer in buffers.values():
+                yield self._merge(buffer)
+        finally:
+            if pending is not None:
+                pending.cancel()
 
 
 # ------------------------------------------------------------------
@@ -90,7 +224,7 @@ def create_outline(
     file_name: Annotated[str, "File path to save the outline."],
 ) -> Annotated[str, "Path of the saved outline file."]:
     """Create and save an outline."""
-    content = "\n".join([f"{i + 1}. {point}" for i, point in enumerate(points)])
+    content = "\n".join(f"{i}. {point}" for i, point in enumerate(points, 1))
     return f"Outline:\n{content}"
 
 
@@ -130,22 +264,181 @@ def generate_chart(
 # 3. Helper Utilities
 # ------------------------------------------------------------------
 
+# 摘要中每条输出保留的最大字符数
+SUMMARY_MAX_CHARS = 512
+
+
+def _append_summary(current: str, update: str) -> str:
+    """摘要归并：按行追加"""
+    return f"{current}\n{update}" if current else update
+
+
+def _summary_line(name: str, content: Any) -> str:
+    """生成一行执行摘要"""
+    return f"{name}: {str(content)[:SUMMARY_MAX_CHARS]}"
+
+
 class State(MessagesState):
-    """State definition matching official tutorial."""
+    """State definition matching official tutorial.
+
+    messages 继承自 MessagesState，使用 add_messages 归并，
+    并行团队的更新可以安全合并。
+    """
     next: str
+    # 主管路由记录：(主管标识, 路由目标, 当时的消息数)，用于检测路由振荡
+    route_history: Annotated[list[tuple[str, str, int]], operator.add]
+    # 各智能体的完整输出通道；共享 messages 中只保留路由标记
+    searcher_msgs: Annotated[list[AnyMessage], add_messages]
+    web_crawler_msgs: Annotated[list[AnyMessage], add_messages]
+    merge_msgs: Annotated[list[AnyMessage], add_messages]
+    writer_msgs: Annotated[list[AnyMessage], add_messages]
+    outline_msgs: Annotated[list[AnyMessage], add_messages]
+    chart_generator_msgs: Annotated[list[AnyMessage], add_messages]
+    # 执行进度摘要：每个智能体追加一行截断后的输出，主管据此路由
+    summary: Annotated[str, _append_summary]
+    # 规划器生成的执行计划（生成后不再修改）与已完成的步骤序号
+    plan: list[dict]
+    plan_done: Annotated[list[int], operator.add]
+
+
+def _agent_update(message: HumanMessage) -> Dict[str, list]:
+    """
+    构造智能体节点的状态更新
+
+    完整输出写入该智能体自己的通道，共享 messages 只追加一条简短的路由标记，
+    主管据此判断执行进度，而不必每次都把全部输出发送给 LLM。
+    """
+    is_error = bool(message.additional_kwargs.get("error"))
+    marker = HumanMessage(
+        content=f"{message.name} {'执行出错' if is_error else '已完成'}",
+        name=message.name,
+        additional_kwargs={"error": True} if is_error else {}
+    )
+    return {
+        "messages": [marker],
+        f"{message.name}_msgs": [message],
+        "summary": _summary_line(message.name, message.content)
+    }
 
 
-def make_supervisor_node(llm, members: list[str]):
-    """Create a supervisor node for managing workers."""
-    options = ["FINISH"] + members
+def _latest_message(state) -> Optional[AnyMessage]:
+    """获取最近一条消息；智能体的路由标记解析为其通道中的完整输出"""
+    messages = state.get("messages") or []
+    if not messages:
+        return None
+    last = messages[-1]
+    outputs = state.get(f"{last.name}_msgs") if last.name else None
+    return outputs[-1] if outputs else last
+
+
+# 同一路由决策连续出现的最大次数，超过即视为振荡
+MAX_REPEATED_ROUTES = 3
+
+# 同一主管在一次执行中路由到同一目标的最大次数（不要求连续），超过即强制结束
+MAX_ROUTE_VISITS = 2
+
+# 各主管的 (结构化路由模型, 系统消息)，按系统提示词去重，供启动预热使用
+_SUPERVISOR_PROMPTS: Dict[str, tuple] = {}
+
+
+# 语义路由缓存：余弦相似度阈值、持久化目录与每个主管的最大条目数
+ROUTE_CACHE_THRESHOLD = float(os.getenv("HAT_ROUTE_CACHE_THRESHOLD", "0.88"))
+ROUTE_CACHE_DIR = os.path.expanduser(os.getenv("HAT_ROUTE_CACHE_DIR", "~/.hat_cache"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("HAT_ROUTE_CACHE_MAX_ENTRIES", "1024"))
+
+
+class RouteCache:
+    """
+    语义路由缓存
+
+    以任务文本的向量为键缓存主管的路由决策，执行进度（已执行的智能体序列）必须完全一致，
+    任务相似度不低于阈值时直接复用，跳过结构化输出的 LLM 调用。
+    向量已归一化，内积即余弦相似度；条目数量有上限，直接用 numpy 暴力检索。
+
+    新决策只写入内存（超出上限时淘汰最早的条目），由 shutdown() 统一落盘。
+    目前只有旧版层级图（get_super_graph）中的写作团队主管启用，默认的规划执行图不使用。
+    """
 
-    # 智能提示词生成系统
-    def generate_system_prompt(members: list[str]) -> str:
-        """根据成员列表生成智能提示词"""
+    def __init__(
+        self,
+        name: str,
+        threshold: float = ROUTE_CACHE_THRESHOLD,
+        cache_dir: str = ROUTE_CACHE_DIR,
+        max_entries: int = ROUTE_CACHE_MAX_ENTRIES
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).hexdigest()
+        self.path = os.path.join(cache_dir, f"route_{digest}.npz")
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.progress: List[str] = []
+        self.decisions: List[str] = []
+        self._dirty = False
+        self._load()
+        _ROUTE_CACHES.append(self)
+
+    def _load(self):
+        """从磁盘恢复历史路由决策（只保留最近的 max_entries 条；缺少进度字段的旧文件直接忽略）"""
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"].astype(np.float32)[-self.max_entries:]
+                progress = data["progress"].tolist()[-self.max_entries:]
+                decisions = data["decisions"].tolist()[-self.max_entries:]
+        except (OSError, KeyError, ValueError):
+            return
+        self.vectors, self.progress, self.decisions = vectors, progress, decisions
+
+    def _save(self, vectors: np.ndarray, progress: List[str], decisions: List[str]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        np.savez(self.path, vectors=vectors, progress=np.array(progress), decisions=np.array(decisions))
+
+    async def embed(self, text: str) -> np.ndarray:
+        """计算归一化后的查询向量"""
+        vector = np.asarray(await embeddings.aembed_query(text), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, vector: np.ndarray, progress: str) -> Optional[str]:
+        """在执行进度完全相同的条目中，返回任务最相似且超过阈值的路由决策"""
+        if not self.decisions or self.vectors.shape[1] != vector.shape[0]:
+            return None
+        scores = np.where(np.asarray(self.progress) == progress, self.vectors @ vector, -np.inf)
+        best = int(np.argmax(scores))
+        return self.decisions[best] if scores[best] >= self.threshold else None
+
+    def add(self, vector: np.ndarray, progress: str, decision: str):
+        """记录新的路由决策，超出上限时淘汰最早的条目"""
+        if self.decisions and self.vectors.shape[1] == vector.shape[0]:
+            start = max(0, len(self.decisions) - self.max_entries + 1)
+            self.vectors = np.vstack([self.vectors[start:], vector[None, :]])
+            self.progress = self.progress[start:]
+            self.decisions = self.decisions[start:]
+        else:
+            self.vectors, self.progress, self.decisions = vector[None, :], [], []
+        self.progress.append(progress)
+        self.decisions.append(decision)
+        self._dirty = True
+
+    async def flush(self):
+        """在线程中把内存中的路由决策写入磁盘，不阻塞事件循环"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._save, self.vectors, list(self.progress), list(self.decisions))
+        except OSError:
+            logger.warning("路由缓存写入失败: %s", self.path, exc_info=True)
+
+
+# 已创建的路由缓存，关闭时统一落盘
+_ROUTE_CACHES: List[RouteCache] = []
+
+
+# ------------------------------------------------------------------
+# 主管系统提示词（模块加载时构建，各主管只在创建时格式化一次）
+# ------------------------------------------------------------------
 
-        # 一级主管：顶级任务分配
-        if set(members) == {"research_team", "document_writing_team"}:
-            return """你是一个智能任务分配专家，负责分析用户任务并分配给合适的团队。
+# 一级主管：顶级任务分配
+_TEAMS_PROMPT = """你是一个智能任务分配专家，负责分析用户任务并分配给合适的团队。
 
 任务类型分析：
 1. 仅研究类任务：
@@ -177,10 +470,8 @@ def make_supervisor_node(llm, members: list[str]):
 成员列表：{members}
 请基于任务实际需要，选择最合适的下一个执行者。"""
 
-        # 二级主管：团队内部任务分配
-        elif "search_team" in members or "writing_team" in members:
-            if "search_team" in members:
-                return """你是研究团队主管，负责分析任务需求并分配给搜索专家。
+# 二级主管：研究团队内部任务分配
+_RESEARCH_PROMPT = """你是研究团队主管，负责分析任务需求并分配给搜索专家。
 
 任务分析：
 - 如果任务只需要基本搜索 → 选择"searcher"
@@ -190,8 +481,8 @@ def make_supervisor_node(llm, members: list[str]):
 成员列表：{members}
 请根据信息收集的深度需求选择合适的专家。"""
 
-            elif "writing_team" in members:
-                return """你是文档写作团队主管，负责分析写作需求并分配给写作专家。
+# 二级主管：写作团队内部任务分配
+_WRITING_PROMPT = """你是文档写作团队主管，负责分析写作需求并分配给写作专家。
 
 任务分析指南：
 1. 简单写作任务：
@@ -222,40 +513,115 @@ def make_supervisor_node(llm, members: list[str]):
 - 每个专家执行后都会提供结果供下一步决策
 - 当所有必要的专家都执行完成后，选择"FINISH"结束任务"""
 
-        # 三级主管：执行层智能体选择
-        else:
-            role_map = {
-                "searcher": "搜索专家",
-                "web_crawler": "网页爬取专家",
-                "writer": "文档写作专家",
-                "outline": "大纲生成专家",
-                "chart_generator": "图表生成专家"
-            }
-            roles = ", ".join([f"{m}({role_map.get(m, m)})" for m in members])
-            return f"""你是执行层主管，负责将任务分配给专业智能体。
+# 三级主管：执行层智能体选择，{members} 填入带角色说明的成员列表
+_EXEC_PROMPT = """你是执行层主管，负责将任务分配给专业智能体。
 
-可用专家：{roles}
+可用专家：{members}
 
 分配原则：
 - 根据任务的具体需求选择最合适的专家
 - 简单任务选择单个专家
 - 复杂任务可以按顺序调用多个专家
+- 互不依赖的专家可以同时选择，它们会并行执行（例如"outline"和"chart_generator"）
+- 依赖其他专家结果的专家（例如需要大纲的"writer"）应在下一步单独选择
 - 每个专家执行后都会返回结果供下一步决策
 
-请选择下一个执行专家。"""
+请选择下一步执行的专家。"""
+
+_EXEC_ROLES = MappingProxyType({
+    "searcher": "搜索专家",
+    "web_crawler": "网页爬取专家",
+    "writer": "文档写作专家",
+    "outline": "大纲生成专家",
+    "chart_generator": "图表生成专家"
+})
+
+
+def _system_prompt(members: list[str]) -> str:
+    """根据成员列表选择并格式化主管提示词"""
+    if set(members) == {"research_team", "document_writing_team"}:
+        return _TEAMS_PROMPT.format(members=members)
+    if "search_team" in members:
+        return _RESEARCH_PROMPT.format(members=members)
+    if "writing_team" in members:
+        return _WRITING_PROMPT.format(members=members)
+    roles = ", ".join(f"{m}({_EXEC_ROLES.get(m, m)})" for m in members)
+    return _EXEC_PROMPT.format(members=roles)
+
+
+def _prompt_cache_key(prompt: str) -> str:
+    """按系统提示词生成稳定的 prompt_cache_key，相同前缀的请求路由到同一缓存"""
+    return "hat-" + hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).hexdigest()
 
-    system_prompt = generate_system_prompt(members).format(members=members)
+
+@functools.lru_cache(maxsize=None)
+def _get_router(members: tuple[str, ...]) -> type:
+    """按成员列表缓存 Router 定义，相同成员的主管共享同一个 schema"""
+    options = ("FINISH",) + members
 
     class Router(TypedDict):
-        """Worker to route to next. If no workers needed, route to FINISH."""
-        next: Literal[*options]
+        """Workers to route to next. Independent workers listed together run in parallel. If no workers needed, route to FINISH."""
+        next: list[Literal[*options]]
+
+    return Router
+
+
+def make_supervisor_node(llm, members: list[str], auto_finish: bool = False, route_cache: bool = False):
+    """Create a supervisor node for managing workers.
+
+    auto_finish=True 时，所有成员都已输出结果后直接结束，不再调用 LLM 路由。
+    route_cache=True 时，相似任务在相同执行进度下复用缓存的路由决策。
+    """
+    options = ["FINISH"] + members
+
+    system_prompt = _system_prompt(members)
+    supervisor_id = ",".join(members)
+
+    # 系统消息只构建一次；每次请求的前缀保持不变，便于命中 OpenAI 的提示词前缀缓存
+    system_message = {"role": "system", "content": system_prompt}
 
-    def supervisor_node(state: State) -> Command[Literal[*members, "__end__"]]:
+    Router = _get_router(tuple(members))
+
+    # 结构化输出绑定只需创建一次，避免每次路由都重新生成 schema；
+    # json_schema 模式使用 response_format 约束解码，不在提示词中附加工具定义；
+    # strict=True 让输出严格符合 schema，路由目标不会越出成员列表；
+    # prompt_cache_key 让 OpenAI 把相同系统提示词的请求路由到同一前缀缓存
+    router_llm = llm.with_structured_output(
+        Router, method="json_schema", strict=True, prompt_cache_key=_prompt_cache_key(system_prompt)
+    )
+    _SUPERVISOR_PROMPTS.setdefault(system_prompt, (router_llm, system_message))
+    cache = RouteCache(supervisor_id) if route_cache else None
+
+    async def supervisor_node(state: State) -> Command[Literal[*members, "__end__"]]:
         """An LLM-based router."""
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ] + state["messages"]
-        response = llm.with_structured_output(Router).invoke(messages)
+        # 所有成员都已执行过，无需再调用 LLM 判断是否结束
+        if auto_finish:
+            visited = {msg.name for msg in state["messages"] if msg.name in members}
+            if len(visited) == len(members):
+                return Command(goto=END, update={"next": END})
+
+        # 语义路由缓存：上一步出错时必须重新决策，不查缓存；
+        # 只对任务文本做向量检索，执行进度必须完全一致
+        cache_vector = cached = progress = None
+        if cache is not None and state["messages"] and not state["messages"][-1].additional_kwargs.get("error"):
+            progress = " -> ".join(msg.name for msg in state["messages"][1:] if msg.name)
+            try:
+                cache_vector = await cache.embed(state["messages"][0].content)
+                cached = cache.lookup(cache_vector, progress)
+            except Exception:
+                logger.warning("路由缓存查询失败，回退到 LLM 路由", exc_info=True)
+                cache_vector = None
+
+        if cached is not None:
+            response = {"next": cached.split(",")}
+        else:
+            # 只发送任务、进度摘要和最近一条消息，输入 token 不随历史长度线性增长
+            messages = [system_message, *state["messages"][:1]]
+            if state.get("summary"):
+                messages.append({"role": "user", "content": f"执行进度摘要：\n{state['summary']}"})
+            if len(state["messages"]) > 1:
+                messages.append(state["messages"][-1])
+            response = await router_llm.ainvoke(messages)
 
         # 安全的访问next字段
         if isinstance(response, dict) and "next" in response:
@@ -273,10 +639,30 @@ def make_supervisor_node(llm, members: list[str]):
                 # 如果找不到路由目标，默认返回第一个选项
                 goto = options[0] if options else "FINISH"
 
-        if goto == "FINISH":
+        # 路由结果可以包含多个互不依赖的目标，这些目标在下一步并行执行
+        targets = list(dict.fromkeys(goto if isinstance(goto, list) else [goto]))
+        if not targets or "FINISH" in targets:
             goto = END
-
-        return Command(goto=goto, update={"next": goto})
+        else:
+            goto = targets if len(targets) > 1 else targets[0]
+        next_route = ",".join(goto) if isinstance(goto, list) else goto
+        if cache_vector is not None and cached is None:
+            cache.add(cache_vector, progress, next_route)
+
+        # 振荡检测：同一主管连续多次路由到同一目标且没有产生新消息时，强制结束
+        route = (supervisor_id, next_route, len(state["messages"]))
+        recent = state.get("route_history", [])[-(MAX_REPEATED_ROUTES - 1):]
+        if goto != END and len(recent) == MAX_REPEATED_ROUTES - 1 and all(entry == route for entry in recent):
+            goto = next_route = END
+            route = (supervisor_id, next_route, route[2])
+
+        # 循环检测：A → B → A → B 这类非连续的重复路由同样会持续消耗 LLM 调用
+        visits = Counter((sup, dest) for sup, dest, _ in state.get("route_history", []))
+        if goto != END and visits[(supervisor_id, next_route)] >= MAX_ROUTE_VISITS:
+            goto = next_route = END
+            route = (supervisor_id, next_route, route[2])
+
+        return Command(goto=goto, update={"next": next_route, "route_history": [route]})
 
     return supervisor_node
 
@@ -285,196 +671,201 @@ def make_supervisor_node(llm, members: list[str]):
 # 4. Create LLM
 # ------------------------------------------------------------------
 
+# 共享 HTTP 连接池：所有主管和智能体复用同一组 HTTP/2 长连接，避免重复 TLS 握手
+http_async_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=httpx.Timeout(60.0),
+)
+
 # Create LLM with streaming support
-llm = ChatOpenAI(model="gpt-4o-mini", streaming=True)
+llm = ChatOpenAI(model="gpt-4o-mini", streaming=True, http_async_client=http_async_client)
+
+# 智能体生成最终内容的调用带 "final" 标签，流式输出时只转发这些 token
+final_llm = llm.with_config(tags=["final"])
 
-# Create research agents
-from langgraph.prebuilt import create_react_agent
+# 主管路由专用模型：只输出很短的 Router 结构，使用确定性的非流式调用，与智能体共享连接池
+router_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, http_async_client=http_async_client)
+
+# 语义路由缓存使用的向量模型
+embeddings = OpenAIEmbeddings(model="text-embedding-3-small", http_async_client=http_async_client)
+
+# 执行层智能体的提示词模板，实时执行与批处理共用
+_WORKER_PROMPTS = MappingProxyType({
+    "searcher": "请搜索以下内容并提供详细结果：{task}",
+    "web_crawler": "请爬取以下网页内容并提取有用信息：{task}",
+    "merge": "请综合以下研究结果，针对任务给出完整的研究结论。\n任务：{task}\n\n{findings}",
+    "writer": "请基于以下信息写作详细文档：{task}",
+    "outline": "请基于以下内容创建详细大纲：{task}",
+    "chart_generator": "请基于以下信息生成图表和可视化内容：{task}",
+})
 
 # ------------------------------------------------------------------
 # 5. Define Search Agents (Layer 3)
 # ------------------------------------------------------------------
 
-searcher_agent = create_react_agent(llm, tools=[web_search])
-web_crawler_agent = create_react_agent(llm, tools=[web_crawler])
-
-def searcher_node(state: State) -> Command[Literal["supervisor"]]:
-    """Searcher node that uses OpenAI streaming API and outputs real streaming chunks."""
+async def searcher_node(state: State) -> Command[Literal["merge"]]:
+    """Searcher node that uses OpenAI streaming API and marks output for streaming."""
     # 获取用户任务
-    task_message = state["messages"][-1].content if state["messages"] else "请搜索相关信息"
+    task_message = _latest_message(state).content if state["messages"] else "请搜索相关信息"
 
     try:
-        # 使用OpenAI的astream获取真正的流式输出
-        stream_content = []
-        prompt = f"请搜索以下内容并提供详细结果：{task_message}"
-
-        # 调用astream获取流式块
-        for chunk in llm.stream([HumanMessage(content=prompt)]):
-            if chunk.content:
-                stream_content.append(chunk.content)
-
-        # 合并所有流式块
-        full_content = "".join(stream_content)
+        # 使用OpenAI流式调用（token 由调度器通过图事件实时转发，不在消息中缓存）
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["searcher"].format(task=task_message))
+        ])
 
-        # 输出流式块（作为消息的一部分传递给TaskScheduler）
+        # 标记输出为流式输出
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(
-                        content=full_content,
-                        name="searcher",
-                        additional_kwargs={
-                            "is_streaming": True,
-                            "streaming_chunks": stream_content  # 保存流式块供TaskScheduler使用
-                        }
-                    )
-                ]
-            },
-            goto="supervisor",
+            update=_agent_update(
+                HumanMessage(content=result.content, name="searcher", additional_kwargs={"is_streaming": True})
+            ),
+            goto="merge",
         )
     except Exception as e:
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=f"搜索过程中发生错误：{str(e)}", name="searcher", additional_kwargs={"error": True})
-                ]
-            },
-            goto="supervisor",
+            update=_agent_update(
+                HumanMessage(content=f"搜索过程中发生错误：{str(e)}", name="searcher", additional_kwargs={"error": True})
+            ),
+            goto="merge",
         )
 
-def web_crawler_node(state: State) -> Command[Literal["supervisor"]]:
+async def web_crawler_node(state: State) -> Command[Literal["merge"]]:
     """Web crawler node that uses OpenAI streaming API and marks output for streaming."""
     # 获取用户任务
-    task_message = state["messages"][-1].content if state["messages"] else "请爬取相关信息"
+    task_message = _latest_message(state).content if state["messages"] else "请爬取相关信息"
 
     try:
         # 使用OpenAI流式调用
-        result = llm.invoke([
-            HumanMessage(content=f"请爬取以下网页内容并提取有用信息：{task_message}")
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["web_crawler"].format(task=task_message))
         ])
 
         # 标记输出为流式输出
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=result.content, name="web_crawler", additional_kwargs={"is_streaming": True})
-                ]
-            },
-            goto="supervisor",
+            update=_agent_update(
+                HumanMessage(content=result.content, name="web_crawler", additional_kwargs={"is_streaming": True})
+            ),
+            goto="merge",
         )
     except Exception as e:
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=f"爬取过程中发生错误：{str(e)}", name="web_crawler", additional_kwargs={"error": True})
-                ]
-            },
-            goto="supervisor",
+            update=_agent_update(
+                HumanMessage(content=f"爬取过程中发生错误：{str(e)}", name="web_crawler", additional_kwargs={"error": True})
+            ),
+            goto="merge",
+        )
+
+async def merge_node(state: State) -> Command[Literal["__end__"]]:
+    """Merge node that synthesizes the parallel searcher/web_crawler results."""
+    findings = state["searcher_msgs"] + state["web_crawler_msgs"]
+    task_message = state["messages"][0].content if state["messages"] else "请汇总研究结果"
+
+    try:
+        # 调用一次 LLM 综合并行得到的研究结果
+        findings_text = "\n\n".join(f"[{msg.name}]\n{msg.content}" for msg in findings)
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["merge"].format(task=task_message, findings=findings_text))
+        ])
+
+        return Command(
+            update=_agent_update(
+                HumanMessage(content=result.content, name="merge", additional_kwargs={"is_streaming": True})
+            ),
+            goto=END,
+        )
+    except Exception as e:
+        return Command(
+            update=_agent_update(
+                HumanMessage(content=f"汇总研究结果过程中发生错误：{str(e)}", name="merge", additional_kwargs={"error": True})
+            ),
+            goto=END,
         )
 
 # ------------------------------------------------------------------
 # 6. Define Document Writing Agents (Layer 3)
 # ------------------------------------------------------------------
 
-writer_agent = create_react_agent(
-    llm,
-    tools=[write_document, read_document, create_outline],
-    prompt=(
-        "You can read, write and edit documents based on research findings. "
-        "Don't ask follow-up questions."
-    ),
-)
-
-outline_agent = create_react_agent(llm, tools=[create_outline])
-chart_generator_agent = create_react_agent(llm, tools=[generate_chart])
-
-def writer_node(state: State) -> Command[Literal["supervisor"]]:
+async def writer_node(state: State) -> Command[Literal["supervisor"]]:
     """Writer node that uses OpenAI streaming API and marks output for streaming."""
     # 获取用户任务
-    task_message = state["messages"][-1].content if state["messages"] else "请写作相关内容"
+    task_message = _latest_message(state).content if state["messages"] else "请写作相关内容"
+
+    # 大纲和图表可能由主管并行分派，两者都已完成时一并作为写作依据
+    prepared = [msgs[-1].content for msgs in (state.get("outline_msgs"), state.get("chart_generator_msgs")) if msgs]
+    if len(prepared) > 1:
+        task_message = "\n\n".join([state["messages"][0].content, *prepared])
 
     try:
         # 使用OpenAI流式调用
-        result = llm.invoke([
-            HumanMessage(content=f"请基于以下信息写作详细文档：{task_message}")
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["writer"].format(task=task_message))
         ])
 
         # 标记输出为流式输出
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=result.content, name="writer", additional_kwargs={"is_streaming": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=result.content, name="writer", additional_kwargs={"is_streaming": True})
+            ),
             goto="supervisor",
         )
     except Exception as e:
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=f"写作过程中发生错误：{str(e)}", name="writer", additional_kwargs={"error": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=f"写作过程中发生错误：{str(e)}", name="writer", additional_kwargs={"error": True})
+            ),
             goto="supervisor",
         )
 
-def outline_node(state: State) -> Command[Literal["supervisor"]]:
+async def outline_node(state: State) -> Command[Literal["supervisor"]]:
     """Outline node that uses OpenAI streaming API and marks output for streaming."""
     # 获取用户任务
-    task_message = state["messages"][-1].content if state["messages"] else "请创建大纲"
+    task_message = _latest_message(state).content if state["messages"] else "请创建大纲"
 
     try:
         # 使用OpenAI流式调用
-        result = llm.invoke([
-            HumanMessage(content=f"请基于以下内容创建详细大纲：{task_message}")
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["outline"].format(task=task_message))
         ])
 
         # 标记输出为流式输出
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=result.content, name="outline", additional_kwargs={"is_streaming": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=result.content, name="outline", additional_kwargs={"is_streaming": True})
+            ),
             goto="supervisor",
         )
     except Exception as e:
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=f"创建大纲过程中发生错误：{str(e)}", name="outline", additional_kwargs={"error": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=f"创建大纲过程中发生错误：{str(e)}", name="outline", additional_kwargs={"error": True})
+            ),
             goto="supervisor",
         )
 
-def chart_generator_node(state: State) -> Command[Literal["supervisor"]]:
+async def chart_generator_node(state: State) -> Command[Literal["supervisor"]]:
     """Chart generator node that uses OpenAI streaming API and marks output for streaming."""
     # 获取用户任务
-    task_message = state["messages"][-1].content if state["messages"] else "请生成图表"
+    task_message = _latest_message(state).content if state["messages"] else "请生成图表"
 
     try:
         # 使用OpenAI流式调用
-        result = llm.invoke([
-            HumanMessage(content=f"请基于以下信息生成图表和可视化内容：{task_message}")
+        result = await final_llm.ainvoke([
+            HumanMessage(content=_WORKER_PROMPTS["chart_generator"].format(task=task_message))
         ])
 
         # 标记输出为流式输出
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=result.content, name="chart_generator", additional_kwargs={"is_streaming": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=result.content, name="chart_generator", additional_kwargs={"is_streaming": True})
+            ),
             goto="supervisor",
         )
     except Exception as e:
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(content=f"生成图表过程中发生错误：{str(e)}", name="chart_generator", additional_kwargs={"error": True})
-                ]
-            },
+            update=_agent_update(
+                HumanMessage(content=f"生成图表过程中发生错误：{str(e)}", name="chart_generator", additional_kwargs={"error": True})
+            ),
             goto="supervisor",
         )
 
@@ -482,141 +873,439 @@ def chart_generator_node(state: State) -> Command[Literal["supervisor"]]:
 # 7. Compose Everything Together (Layer 2)
 # ------------------------------------------------------------------
 
-# Create research team supervisor (Layer 2) - 直接管理三级智能体
-research_team_supervisor = make_supervisor_node(llm, ["searcher", "web_crawler"])
-research_builder_layer2 = StateGraph(State)
-research_builder_layer2.add_node("supervisor", research_team_supervisor)
-research_builder_layer2.add_node("searcher", searcher_node)
-research_builder_layer2.add_node("web_crawler", web_crawler_node)
-research_builder_layer2.add_edge(START, "supervisor")
-research_team_graph = research_builder_layer2.compile()
-
-def call_research_team(state: State) -> Command[Literal["supervisor"]]:
-    """Function to call the research team subgraph."""
-    # Get the last message from state
-    last_message = state["messages"][-1] if state["messages"] else None
-    if last_message is None:
-        # If no messages, create a default message
-        last_message = HumanMessage(content="请开始处理任务", name="user")
-
-    # Invoke the subgraph
-    response = research_team_graph.invoke({"messages": [last_message]})
-
-    # Handle Command response
-    if isinstance(response, Command):
-        # Extract messages from the command's update
-        messages = response.update.get("messages", [])
-        final_message = messages[-1] if messages else HumanMessage(content="任务处理完成", name="research_team")
+class TeamInput(TypedDict):
+    """团队子图的输入：只接收共享消息，其余通道在子图内从空开始"""
+    messages: Annotated[list[AnyMessage], add_messages]
 
-        return Command(
-            update={
-                "messages": [
-                    HumanMessage(
-                        content=final_message.content, name="research_team"
-                    )
-                ]
-            },
-            goto=response.goto,
-        )
-    else:
-        # Handle regular dict response
-        messages = response.get("messages", [])
-        final_message = messages[-1] if messages else HumanMessage(content="任务处理完成", name="research_team")
 
-        return Command(
-            update={
-                "messages": [
-                    HumanMessage(
-                        content=final_message.content, name="research_team"
-                    )
-                ]
-            },
-            goto="supervisor",
-        )
+class TeamOutput(TeamInput):
+    """
+    团队子图写回父图的通道
+
+    只包含带归并函数的通道：消息按 ID 去重，摘要和路由记录只含子图内新增的部分，
+    两个团队并行结束时可以安全合并；next 等单值通道不写回。
+    """
+    searcher_msgs: Annotated[list[AnyMessage], add_messages]
+    web_crawler_msgs: Annotated[list[AnyMessage], add_messages]
+    merge_msgs: Annotated[list[AnyMessage], add_messages]
+    writer_msgs: Annotated[list[AnyMessage], add_messages]
+    outline_msgs: Annotated[list[AnyMessage], add_messages]
+    chart_generator_msgs: Annotated[list[AnyMessage], add_messages]
+    summary: Annotated[str, _append_summary]
+    route_history: Annotated[list[tuple[str, str, int]], operator.add]
+
+
+def research_dispatch(state: State) -> list[Send]:
+    """并行分发研究任务：搜索和网页爬取互不依赖，同时执行"""
+    return [Send("searcher", state), Send("web_crawler", state)]
+
+
+def _build_research_team_graph():
+    """Create research team (Layer 2) - 三级智能体并行执行，由 merge 节点汇总"""
+    builder = StateGraph(State, input_schema=TeamInput, output_schema=TeamOutput)
+    builder.add_node("searcher", searcher_node)
+    builder.add_node("web_crawler", web_crawler_node)
+    builder.add_node("merge", merge_node)
+    builder.add_conditional_edges(START, research_dispatch, ["searcher", "web_crawler"])
+    return builder.compile()
+
+
+def _build_writing_team_graph():
+    """Create document writing team (Layer 2) - 团队主管直接管理三级智能体"""
+    supervisor = make_supervisor_node(router_llm, ["writer", "outline", "chart_generator"], auto_finish=True, route_cache=True)
+    builder = StateGraph(State, input_schema=TeamInput, output_schema=TeamOutput)
+    builder.add_node("supervisor", supervisor)
+    builder.add_node("writer", writer_node)
+    builder.add_node("outline", outline_node)
+    builder.add_node("chart_generator", chart_generator_node)
+    builder.add_edge(START, "supervisor")
+    return builder.compile()
+
+
+def _team_router(*channels: str):
+    """团队子图结束后的路由：任一输出通道的最新结果出错时交回一级主管重新规划，否则结束"""
+    def route(state: State) -> Literal["supervisor", "__end__"]:
+        outputs = [state[channel][-1] for channel in channels if state.get(channel)]
+        if any(msg.additional_kwargs.get("error") for msg in outputs):
+            return "supervisor"
+        return END
+
+    return route
+
+
+# ------------------------------------------------------------------
+# 8. Top-level Supervisor (Layer 1)
+# ------------------------------------------------------------------
+
+def parallel_dispatch(state: State) -> list[Send]:
+    """并行分发任务：研究团队和文档写作团队同时执行"""
+    return [
+        Send("research_team", {"messages": state["messages"]}),
+        Send("document_writing_team", {"messages": state["messages"]}),
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def get_super_graph():
+    """
+    构建旧版层级主管图（首次调用时编译并缓存）
+
+    实时路径使用 planner_graph；旧版图延迟到需要时才构建，
+    导入模块时不再创建两个主管、加载路由缓存并编译三张图。
+    两个团队并行执行，结果通过 add_messages 合并。
+    """
+    # 一级主管仅在团队执行出错、需要重新规划时介入
+    teams_supervisor = make_supervisor_node(router_llm, ["research_team", "document_writing_team"])
 
-# Create document writing team supervisor (Layer 2) - 直接管理三级智能体
-writing_team_supervisor = make_supervisor_node(llm, ["writer", "outline", "chart_generator"])
-writing_builder_layer2 = StateGraph(State)
-writing_builder_layer2.add_node("supervisor", writing_team_supervisor)
-writing_builder_layer2.add_node("writer", writer_node)
-writing_builder_layer2.add_node("outline", outline_node)
-writing_builder_layer2.add_node("chart_generator", chart_generator_node)
-writing_builder_layer2.add_edge(START, "supervisor")
-writing_team_graph = writing_builder_layer2.compile()
-
-def call_document_writing_team(state: State) -> Command[Literal["supervisor"]]:
-    """Function to call the document writing team subgraph."""
-    # Get the last message from state
-    last_message = state["messages"][-1] if state["messages"] else None
-    if last_message is None:
-        # If no messages, create a default message
-        last_message = HumanMessage(content="请开始处理任务", name="user")
-
-    # Invoke the subgraph
-    response = writing_team_graph.invoke({"messages": [last_message]})
-
-    # Handle Command response
-    if isinstance(response, Command):
-        # Extract messages from the command's update
-        messages = response.update.get("messages", [])
-        final_message = messages[-1] if messages else HumanMessage(content="任务处理完成", name="document_writing_team")
+    builder = StateGraph(State)
+    builder.add_node("supervisor", teams_supervisor)
+    # 团队子图直接注册为节点，由 LangGraph 按 TeamInput/TeamOutput 映射状态
+    builder.add_node("research_team", _build_research_team_graph().with_config(run_name="research_team"))
+    builder.add_node("document_writing_team", _build_writing_team_graph().with_config(run_name="document_writing_team"))
 
+    builder.add_conditional_edges(START, parallel_dispatch, ["research_team", "document_writing_team"])
+    builder.add_conditional_edges("research_team", _team_router("merge_msgs"), ["supervisor", END])
+    builder.add_conditional_edges(
+        "document_writing_team",
+        _team_router("outline_msgs", "chart_generator_msgs", "writer_msgs"),
+        ["supervisor", END]
+    )
+    return builder.compile()
+
+
+# ------------------------------------------------------------------
+# 9. Planner (Workflow Compilation)
+# ------------------------------------------------------------------
+
+# 规划器可以调度的执行层智能体
+PLANNER_AGENTS = ("searcher", "web_crawler", "merge", "outline", "chart_generator", "writer")
+
+# 单个计划的最大步数；每一轮并行执行占两个图步骤，RECURSION_LIMIT 据此推导
+MAX_PLAN_STEPS = 12
+
+# 规划失败或计划为空时使用的默认计划：研究 → 汇总 → 大纲与图表并行 → 写作
+DEFAULT_PLAN = (
+    {"agent": "searcher", "depends_on": []},
+    {"agent": "web_crawler", "depends_on": []},
+    {"agent": "merge", "depends_on": [0, 1]},
+    {"agent": "outline", "depends_on": [2]},
+    {"agent": "chart_generator", "depends_on": [2]},
+    {"agent": "writer", "depends_on": [3, 4]},
+)
+
+PLANNER_PROMPT = """你是任务规划器，负责一次性为用户任务编排完整的执行计划。
+
+可用专家：
+- searcher(搜索专家)：搜索任务相关信息
+- web_crawler(网页爬取专家)：爬取并提取网页内容
+- merge(研究结果汇总)：综合 searcher 和 web_crawler 的结果，必须依赖它们
+- outline(大纲生成专家)：生成文档大纲
+- chart_generator(图表生成专家)：生成图表和可视化内容
+- writer(文档写作专家)：基于前序结果写作完整文档
+
+规划原则：
+- 只选择完成任务所必需的专家，每个专家通常只出现一次
+- depends_on 填写该步骤需要其结果的前序步骤序号（从 0 开始，只能引用排在前面的步骤）
+- 没有依赖关系的步骤会并行执行
+- 纯研究任务在 merge 后结束；写作任务让 writer 依赖 outline 或研究结论"""
+
+
+class PlanStep(TypedDict):
+    """One worker invocation. depends_on lists the indices of earlier steps whose output it needs."""
+    agent: Literal[*PLANNER_AGENTS]
+    depends_on: list[int]
+
+
+class Plan(TypedDict):
+    """Execution plan for the task. Steps without dependencies between them run in parallel."""
+    steps: list[PlanStep]
+
+
+# 与主管路由相同：严格 schema 约束解码，计划步骤只会引用已知的智能体
+planner_llm = router_llm.with_structured_output(
+    Plan, method="json_schema", strict=True, prompt_cache_key=_prompt_cache_key(PLANNER_PROMPT)
+)
+_PLANNER_MESSAGE = {"role": "system", "content": PLANNER_PROMPT}
+_SUPERVISOR_PROMPTS.setdefault(PLANNER_PROMPT, (planner_llm, _PLANNER_MESSAGE))
+
+
+def _normalize_plan(steps: list) -> list[dict]:
+    """
+    校验规划结果
+
+    丢弃未知智能体的步骤并重新编号，依赖只保留排在前面的步骤，
+    因此计划一定是无环的。
+    """
+    plan, index_map = [], {}
+    for index, step in enumerate(steps[:MAX_PLAN_STEPS]):
+        if not isinstance(step, dict) or step.get("agent") not in PLANNER_AGENTS:
+            continue
+        depends_on = sorted({index_map[d] for d in step.get("depends_on") or [] if d in index_map})
+        index_map[index] = len(plan)
+        plan.append({"agent": step["agent"], "depends_on": depends_on})
+    return plan
+
+
+async def _plan_task(task_message: AnyMessage) -> list[dict]:
+    """调用一次规划器生成执行计划；规划失败或计划为空时返回默认计划"""
+    try:
+        response = await planner_llm.ainvoke([_PLANNER_MESSAGE, task_message])
+        plan = _normalize_plan(response.get("steps") or []) if isinstance(response, dict) else []
+    except Exception:
+        logger.warning("任务规划失败，使用默认计划", exc_info=True)
+        plan = []
+    return plan or [dict(step) for step in DEFAULT_PLAN]
+
+
+async def planner_node(state: State) -> Command[Literal["plan_executor"]]:
+    """Planner node: one LLM call compiles the whole task into a dependency graph of worker steps."""
+    return Command(update={"plan": await _plan_task(state["messages"][0])}, goto="plan_executor")
+
+
+def _step_input(state: State, index: int) -> Dict[str, Any]:
+    """构造计划步骤的输入：原始任务之后依次是所依赖步骤的输出"""
+    plan = state["plan"]
+    inputs = []
+    for dep in plan[index]["depends_on"]:
+        outputs = state.get(f"{plan[dep]['agent']}_msgs")
+        if outputs:
+            inputs.append(outputs[-1])
+    return {**state, "messages": [state["messages"][0], *inputs], "plan_step": index}
+
+
+def plan_executor_node(state: State) -> Command:
+    """
+    确定性地执行计划，不调用 LLM
+
+    每一轮把依赖均已完成的步骤通过 Send 同时分发，它们在同一个图步骤内并行执行，
+    全部完成后回到这里分发下一轮，直到计划中的步骤全部完成。
+    """
+    plan = state.get("plan") or []
+    done = set(state.get("plan_done", []))
+    ready = [
+        index for index, step in enumerate(plan)
+        if index not in done and all(dep in done for dep in step["depends_on"])
+    ]
+    if not ready:
+        return Command(goto=END, update={"next": END})
+    return Command(
+        goto=[Send(plan[index]["agent"], _step_input(state, index)) for index in ready],
+        update={"next": ",".join(plan[index]["agent"] for index in ready)}
+    )
+
+
+def _plan_step(node):
+    """
+    包装执行层节点：记录完成的计划步骤，并统一交回计划执行器
+
+    不使用 functools.wraps：它会复制原节点的返回注解（如 Command[Literal["supervisor"]]），
+    LangGraph 据此推断出指向不存在节点的边，编译时报错。
+    """
+    async def wrapper(state: Dict[str, Any]) -> Command[Literal["plan_executor"]]:
+        result = await node(state)
         return Command(
-            update={
-                "messages": [
-                    HumanMessage(
-                        content=final_message.content, name="document_writing_team"
-                    )
-                ]
-            },
-            goto=response.goto,
+            update={**(result.update or {}), "plan_done": [state["plan_step"]]},
+            goto="plan_executor",
         )
+
+    wrapper.__name__ = node.__name__
+    wrapper.__doc__ = node.__doc__
+    return wrapper
+
+
+# 规划执行图：一次规划调用 + 按依赖并行执行各智能体，层级主管图保留为旧版实现
+planner_builder = StateGraph(State)
+planner_builder.add_node("planner", planner_node)
+planner_builder.add_node("plan_executor", plan_executor_node)
+for agent_name, agent_node in (
+    ("searcher", searcher_node),
+    ("web_crawler", web_crawler_node),
+    ("merge", merge_node),
+    ("outline", outline_node),
+    ("chart_generator", chart_generator_node),
+    ("writer", writer_node),
+):
+    planner_builder.add_node(agent_name, _plan_step(agent_node))
+planner_builder.add_edge(START, "planner")
+planner_graph = planner_builder.compile()
+
+
+# ------------------------------------------------------------------
+# 批处理执行（OpenAI Batch API，适用于评测等不要求实时响应的场景）
+# ------------------------------------------------------------------
+
+# 批处理任务状态轮询间隔（秒）
+BATCH_POLL_INTERVAL = 30
+
+_BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+batch_client = AsyncOpenAI(http_client=http_async_client)
+
+
+def _step_prompt(agent: str, task: str, inputs: list[tuple[str, str]]) -> str:
+    """
+    构造批处理中单个计划步骤的提示词，与实时执行时各节点的输入保持一致
+
+    Args:
+        agent: 智能体名称
+        task: 原始任务
+        inputs: 所依赖步骤的 (智能体名称, 输出内容)
+    """
+    if agent == "merge":
+        findings = "\n\n".join(f"[{name}]\n{content}" for name, content in inputs if name in ("searcher", "web_crawler"))
+        return _WORKER_PROMPTS["merge"].format(task=task, findings=findings)
+
+    prepared = [content for name, content in inputs if name in ("outline", "chart_generator")]
+    if agent == "writer" and len(prepared) > 1:
+        task_message = "\n\n".join([task, *prepared])
     else:
-        # Handle regular dict response
-        messages = response.get("messages", [])
-        final_message = messages[-1] if messages else HumanMessage(content="任务处理完成", name="document_writing_team")
+        task_message = inputs[-1][1] if inputs else task
+    return _WORKER_PROMPTS[agent].format(task=task_message)
+
+
+async def _run_openai_batch(requests: list[dict]) -> Dict[str, str]:
+    """
+    提交一批 chat completions 请求并等待完成
+
+    Returns:
+        Dict[str, str]: custom_id 到输出内容的映射；失败的请求不在结果中
+    """
+    payload = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests).encode("utf-8")
+    input_file = await batch_client.files.create(file=("batch.jsonl", payload), purpose="batch")
+    batch = await batch_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    while batch.status not in _BATCH_TERMINAL_STATUSES:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await batch_client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"批处理任务 {batch.id} 未完成: {batch.status}")
+
+    output = await batch_client.files.content(batch.output_file_id)
+    results = {}
+    for line in output.text.splitlines():
+        item = json.loads(line)
+        choices = ((item.get("response") or {}).get("body") or {}).get("choices") or []
+        if choices:
+            results[item["custom_id"]] = choices[0]["message"]["content"]
+    return results
 
-        return Command(
-            update={
-                "messages": [
-                    HumanMessage(
-                        content=final_message.content, name="document_writing_team"
-                    )
-                ]
-            },
-            goto="supervisor",
-        )
 
 # ------------------------------------------------------------------
-# 8. Top-level Supervisor (Layer 1)
+# 10. Warmup & Shutdown
 # ------------------------------------------------------------------
 
-# 创建主管节点（直接路由到第3级智能体）
-teams_supervisor_node = make_supervisor_node(llm, ["searcher", "web_crawler", "writer", "outline", "chart_generator"])
+async def warmup() -> None:
+    """
+    启动预热：为每个不同的主管提示词发送一次极短的路由请求
+
+    提前建立连接池中的 HTTP/2 连接，并让 OpenAI 侧缓存系统提示词前缀，
+    降低首个用户请求的首包延迟。提示词前缀必须逐字节保持不变才能命中缓存，
+    因此系统消息在 make_supervisor_node 中只构建一次、不得拼接动态内容。
+    """
+    results = await asyncio.gather(
+        *(
+            router.ainvoke([system_message, HumanMessage(content="ping")])
+            for router, system_message in _SUPERVISOR_PROMPTS.values()
+        ),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("主管预热失败: %s", result)
 
-# Define the top-level graph (Layer 1) - 直接包含第3级智能体
-super_builder = StateGraph(State)
-super_builder.add_node("supervisor", teams_supervisor_node)
-# 直接添加第3级智能体作为顶层节点
-super_builder.add_node("searcher", searcher_node)
-super_builder.add_node("web_crawler", web_crawler_node)
-super_builder.add_node("writer", writer_node)
-super_builder.add_node("outline", outline_node)
-super_builder.add_node("chart_generator", chart_generator_node)
 
-super_builder.add_edge(START, "supervisor")
-super_graph = super_builder.compile()
+async def shutdown() -> None:
+    """将路由缓存落盘，并关闭共享的 HTTP 连接池，释放长连接"""
+    await asyncio.gather(*(cache.flush() for cache in _ROUTE_CACHES))
+    await http_async_client.aclose()
 
 
 # ------------------------------------------------------------------
 # 6. FastAPI Adapter
 # ------------------------------------------------------------------
 
+# 图执行的最大步数，按计划规模推导：规划 1 步 + 每轮分发与执行 2 步 + 结束余量；
+# 计划步数已被限制在 MAX_PLAN_STEPS 以内，失控时最多多走一轮而不是数十步
+RECURSION_LIMIT = MAX_PLAN_STEPS * 2 + 4
+
+# 主管与任务调度器输出帧的公共字段
+_SUPERVISOR_FRAME = {"agent": "主管", "node": "supervisor"}
+_SCHEDULER_FRAME = {"agent": "任务调度器", "node": "scheduler"}
+
+# 任务类型预判关键词，预编译为单个正则，一次扫描即可判断
+_RESEARCH_RE = re.compile("|".join(map(re.escape, ['搜索', '查找', '调研', '分析数据', '趋势', '最新'])))
+_WRITING_RE = re.compile("|".join(map(re.escape, ['写', '创建', '编辑', '文档', '报告'])))
+
+# 任务结果缓存容量（0 表示关闭缓存）与有效期（秒）
+HAT_CACHE_SIZE = int(os.getenv("HAT_CACHE_SIZE", "128"))
+HAT_CACHE_TTL = float(os.getenv("HAT_CACHE_TTL", "3600"))
+
+# 模型与提示词指纹：任一变化都会使任务缓存失效
+_TASK_FINGERPRINT = hashlib.blake2b(
+    "|".join([llm.model_name, PLANNER_PROMPT, *_WORKER_PROMPTS.values()]).encode("utf-8"),
+    digest_size=8
+).hexdigest()
+
+# 执行摘要中列出的智能体
+_SUMMARY_AGENTS = frozenset({
+    'supervisor', 'research_team', 'document_writing_team',
+    'searcher', 'web_crawler', 'merge', 'writer', 'outline', 'chart_generator'
+})
+
+# 回放缓存帧时，每输出多少帧让出一次事件循环
+_YIELD_EVERY_CHUNKS = 16
+
+# 负责规划与路由的节点，不计入被调用的智能体
+_CONTROL_NODES = frozenset({"supervisor", "planner", "plan_executor"})
+
+# 节点显示名称（中文），只读映射，模块加载时构建一次；
+# 键值均驻留（intern），各帧共享同一个字符串对象
+_DISPLAY_NAMES = MappingProxyType({sys.intern(node): sys.intern(name) for node, name in {
+    'supervisor': '主管',
+    'planner': '任务规划器',
+    'plan_executor': '计划执行器',
+    'searcher': '网页搜索智能体',
+    'web_crawler': '网页爬取智能体',
+    'writer': '文档写作智能体',
+    'outline': '大纲生成智能体',
+    'chart_generator': '图表生成智能体',
+    'merge': '研究结果汇总',
+    'research_team': '研究团队',
+    'document_writing_team': '文档写作团队',
+    'search_team': '搜索团队',
+    'writing_team': '写作团队'
+}.items()})
+
+
+def _node_error(output: Any) -> Optional[BaseMessage]:
+    """
+    从节点输出的状态更新中取出标记为出错的消息
+
+    智能体捕获异常后不会抛出，而是在 additional_kwargs 中写入 error 标记；只看各通道的
+    最新消息（团队子图输出完整历史），优先返回智能体自己通道中的完整消息（包含错误详情），
+    其次是共享 messages 中的路由标记。
+    """
+    update = output.update if isinstance(output, Command) else output
+    if not isinstance(update, dict):
+        return None
+    for channel in sorted(update, key=lambda channel: not channel.endswith("_msgs")):
+        value = update[channel]
+        if isinstance(value, list) and value:
+            message = value[-1]
+            if isinstance(message, BaseMessage) and message.additional_kwargs.get("error"):
+                return message
+    return None
+
+
 class HierarchicalAgentTeam:
     """分层智能体团队系统 - 适配 FastAPI"""
 
     def __init__(self):
-        self.graph = super_graph
+        self.graph = planner_graph
 
     def _get_node_display_name(self, node_name: str) -> str:
         """
@@ -628,19 +1317,89 @@ class HierarchicalAgentTeam:
         Returns:
             str: 显示名称（中文）
         """
-        display_names = {
-            'supervisor': '主管',
-            'searcher': '网页搜索智能体',
-            'web_crawler': '网页爬取智能体',
-            'writer': '文档写作智能体',
-            'outline': '大纲生成智能体',
-            'chart_generator': '图表生成智能体',
-            'research_team': '研究团队',
-            'document_writing_team': '文档写作团队',
-            'search_team': '搜索团队',
-            'writing_team': '写作团队'
-        }
-        return display_names.get(node_name, node_name)
+        return _DISPLAY_NAMES.get(node_name, node_name)
+
+    async def warmup(self) -> None:
+        """
+        启动预热：图已在模块加载时编译，这里只预热图中各主管与规划器的
+        提示词缓存和共享 HTTP 连接池
+        """
+        await warmup()
+
+    async def _graph_frames(self, initial_state: Dict[str, Any], agents_called: set, enable_streaming: bool):
+        """
+        执行图并将执行事件转换为流式输出帧
+
+        Args:
+            initial_state: 图的初始状态
+            agents_called: 收集被调用的智能体名称
+            enable_streaming: 是否输出节点开始/完成帧（结果帧与错误帧总是输出）
+
+        Yields:
+            Dict: 节点开始/结束帧（智能体出错时为错误帧）以及模型 token 帧
+        """
+        # 逐 token 调用，循环前绑定为局部变量
+        display_name_of = self._get_node_display_name
+
+        async for event in self.graph.astream_events(
+            initial_state, version="v2", config={"recursion_limit": RECURSION_LIMIT}
+        ):
+            kind = event["event"]
+            node_name = event.get("metadata", {}).get("langgraph_node")
+            # 计划执行器只做确定性分发，不单独展示
+            if node_name is None or node_name == "plan_executor":
+                continue
+
+            # 节点自身的开始/结束事件（事件名与所在节点名一致）
+            is_node_event = event["name"] == node_name
+
+            if kind == "on_chain_start" and is_node_event:
+                if node_name not in _CONTROL_NODES:
+                    agents_called.add(node_name)
+                if enable_streaming:
+                    display_name = display_name_of(node_name)
+                    yield {
+                        "type": "thinking",
+                        "agent": display_name,
+                        "message": f"⚙️ 正在执行 {display_name} 任务...",
+                        "node": node_name,
+                        "timestamp": now_iso()
+                    }
+
+            elif kind == "on_chain_end" and is_node_event:
+                # 智能体出错时输出错误帧，而不是"执行完成"；非流式执行也输出，调用方据此判断成败
+                error = _node_error(event["data"].get("output"))
+                if error is not None:
+                    yield {
+                        "type": "error",
+                        "agent": display_name_of(node_name),
+                        "message": error.content,
+                        "node": node_name,
+                        "timestamp": now_iso()
+                    }
+                elif enable_streaming:
+                    display_name = display_name_of(node_name)
+                    yield {
+                        "type": "status",
+                        "agent": display_name,
+                        "message": f"✅ {display_name} 执行完成",
+                        "node": node_name,
+                        "timestamp": now_iso()
+                    }
+
+            elif kind == "on_chat_model_stream" and "final" in event.get("tags", []):
+                # 智能体生成的 token 到达即转发（主管的路由调用不带标签，不会输出）；
+                # 非流式执行同样输出，由 execute_sync 拼接为最终结果
+                content = event["data"]["chunk"].content
+                if content:
+                    yield {
+                        "type": "result",
+                        "agent": display_name_of(node_name),
+                        "message": content,
+                        "node": node_name,
+                        "timestamp": now_iso(),
+                        "is_real_streaming": True  # 模型 token 原样拼接，前端不加分隔符
+                    }
 
     async def process_task_stream(self, task: str, enable_streaming: bool = True):
         """
@@ -657,21 +1416,10 @@ class HierarchicalAgentTeam:
         agents_called = set()  # 在外部定义，供异常处理使用
 
         try:
-            # 步骤 1: 智能任务分析和执行计划编排
-            if enable_streaming:
-                yield {
-                    "type": "thinking",
-                    "agent": "主管",
-                    "message": "正在分析任务需求并制定执行计划...",
-                    "node": "supervisor",
-                    "timestamp": datetime.now().isoformat()
-                }
-                await asyncio.sleep(0.1)
-
-            # 任务类型预判和执行计划编排
+            # 步骤 1: 任务类型预判和执行计划编排
             task_lower = task.lower()
-            is_research_only = any(keyword in task_lower for keyword in ['搜索', '查找', '调研', '分析数据', '趋势', '最新'])
-            is_writing_only = any(keyword in task_lower for keyword in ['写', '创建', '编辑', '文档', '报告'])
+            is_research_only = _RESEARCH_RE.search(task_lower) is not None
+            is_writing_only = _WRITING_RE.search(task_lower) is not None
             is_research_writing = is_research_only and is_writing_only
 
             # 编排执行流程
@@ -682,8 +1430,9 @@ class HierarchicalAgentTeam:
                 execution_plan = ["📝 文档写作团队 → 大纲生成专家 → 写作专家 → 图表生成专家"]
             elif is_research_writing:
                 execution_plan = [
-                    "🔍 步骤1：研究团队 → 搜索专家 → 网页爬取专家",
-                    "📝 步骤2：文档写作团队 → 大纲生成专家 → 写作专家 → 图表生成专家"
+                    "🔍 研究团队 → 搜索专家 → 网页爬取专家",
+                    "📝 文档写作团队 → 大纲生成专家 → 写作专家 → 图表生成专家",
+                    "⚡ 两个团队并行执行"
                 ]
             else:
                 execution_plan = ["🔄 任务类型待定，将根据执行过程动态调整"]
@@ -691,134 +1440,111 @@ class HierarchicalAgentTeam:
             # 展示完整的任务执行流程
             if enable_streaming:
                 plan_message = "📋 **任务执行计划**\n\n" + "\n\n".join(execution_plan) + "\n\n✅ 开始执行..."
-                yield {
+                yield _SUPERVISOR_FRAME | {
                     "type": "status",
-                    "agent": "主管",
                     "message": plan_message,
-                    "node": "supervisor",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.1)
 
-            # 步骤 2: 执行真实任务并追踪过程
+            # 步骤 2: 执行真实任务，直接转发图执行过程中的真实事件（result 帧批量合并）
             initial_state = {"messages": [HumanMessage(content=task)]}
-
-            # 启动执行（无流式输出）
-            if enable_streaming:
-                yield {
-                    "type": "status",
-                    "agent": "主管",
-                    "message": "🚀 启动智能体团队执行...",
-                    "node": "supervisor",
-                    "timestamp": datetime.now().isoformat()
-                }
-                await asyncio.sleep(0.05)
-
-            # 使用 astream 执行并实时追踪
-            async for chunk in self.graph.astream(initial_state, config={"recursion_limit": 150}):
-                # 遍历每个节点
-                for node_name, output in chunk.items():
-                    # 获取节点显示名称
-                    display_name = self._get_node_display_name(node_name)
-
-                    # 记录调用的智能体
-                    if hasattr(output, 'get') and isinstance(output, dict):
-                        if 'messages' in output:
-                            for msg in output['messages']:
-                                if hasattr(msg, 'name') and msg.name:
-                                    agents_called.add(msg.name)
-
-                    # 如果启用流式输出，为每个节点创建单独的消息框
-                    if enable_streaming:
-                        # 节点开始执行的消息
-                        yield {
-                            "type": "thinking",
-                            "agent": display_name,
-                            "message": f"⚙️ 正在执行 {display_name} 任务...",
-                            "node": node_name,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        await asyncio.sleep(0.05)
-
-                        # 如果有消息输出，逐个输出
-                        if hasattr(output, 'get') and isinstance(output, dict):
-                            if 'messages' in output:
-                                for msg in output['messages']:
-                                    if hasattr(msg, 'content') and msg.content:
-                                        # 逐字流式输出
-                                        words = msg.content.split()
-                                        chunk_size = min(5, max(1, len(words) // 10))
-                                        for i in range(0, len(words), chunk_size):
-                                            word_chunk = " ".join(words[i:i+chunk_size])
-                                            yield {
-                                                "type": "result",
-                                                "agent": display_name,
-                                                "message": word_chunk,
-                                                "node": node_name,
-                                                "timestamp": datetime.now().isoformat()
-                                            }
-                                            await asyncio.sleep(0.02)
-
-                        # 节点完成消息
-                        yield {
-                            "type": "status",
-                            "agent": display_name,
-                            "message": f"✅ {display_name} 执行完成",
-                            "node": node_name,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        await asyncio.sleep(0.05)
+            frames = self._graph_frames(initial_state, agents_called, enable_streaming)
+            async for frame in _StreamBatcher().batch(frames):
+                yield frame
 
             # 步骤 3: 生成执行摘要（仅在流式输出时）
             if enable_streaming:
-                yield {
+                yield _SUPERVISOR_FRAME | {
                     "type": "thinking",
-                    "agent": "主管",
                     "message": "📊 整理执行结果...",
-                    "node": "supervisor",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.05)
 
                 # 生成调度摘要
                 if agents_called:
                     agent_names = [self._get_node_display_name(agent) for agent in agents_called]
-                    yield {
+                    yield _SUPERVISOR_FRAME | {
                         "type": "status",
-                        "agent": "主管",
                         "message": f"🎯 执行完成！共调用了 {len(agents_called)} 个智能体：{', '.join(agent_names)}",
-                        "node": "supervisor",
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": now_iso()
                     }
                 else:
-                    yield {
+                    yield _SUPERVISOR_FRAME | {
                         "type": "status",
-                        "agent": "主管",
                         "message": "⚠️ 未检测到智能体调用",
-                        "node": "supervisor",
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": now_iso()
                     }
 
-                await asyncio.sleep(0.05)
-
             # 步骤 5: 发送完成信号
             yield {
                 "type": "end",
                 "agent": "系统",
                 "message": f"✨ 任务执行完成（调用{len(agents_called)}个智能体）",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso()
             }
 
         except Exception as e:
-            print(f"流式调用错误: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("流式调用错误: %s", e)
             yield {
                 "type": "error",
                 "agent": "系统",
                 "message": f"任务执行出错: {str(e)}",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso()
+            }
+
+    async def run_batch(self, tasks: List[str]) -> List[Dict[str, Any]]:
+        """
+        通过 OpenAI Batch API 批量执行任务（费用约为实时调用的一半，但不保证时延）
+
+        每个任务先实时调用一次规划器生成执行计划，然后按依赖关系分轮提交：
+        每一轮把所有任务中依赖已完成的步骤打包为一个批处理任务，
+        结果按 custom_id（"任务序号:步骤序号"）回填。
+
+        Args:
+            tasks: 任务列表
+
+        Returns:
+            List[Dict]: 每个任务的执行计划和各步骤输出
+        """
+        plans = await asyncio.gather(*(_plan_task(HumanMessage(content=task)) for task in tasks))
+        outputs: List[Dict[int, str]] = [{} for _ in tasks]
+
+        while True:
+            requests = []
+            for task_index, (task, plan) in enumerate(zip(tasks, plans)):
+                done = outputs[task_index]
+                for step_index, step in enumerate(plan):
+                    if step_index in done or not all(dep in done for dep in step["depends_on"]):
+                        continue
+                    inputs = [(plan[dep]["agent"], done[dep]) for dep in step["depends_on"]]
+                    requests.append({
+                        "custom_id": f"{task_index}:{step_index}",
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": {
+                            "model": llm.model_name,
+                            "messages": [{"role": "user", "content": _step_prompt(step["agent"], task, inputs)}],
+                        },
+                    })
+            if not requests:
+                break
+
+            results = await _run_openai_batch(requests)
+            for request in requests:
+                task_index, step_index = map(int, request["custom_id"].split(":"))
+                outputs[task_index][step_index] = results.get(request["custom_id"], "批处理调用失败")
+
+        return [
+            {
+                "task": task,
+                "plan": plan,
+                "results": [
+                    {"agent": step["agent"], "content": outputs[task_index][step_index]}
+                    for step_index, step in enumerate(plan)
+                ],
             }
+            for task_index, (task, plan) in enumerate(zip(tasks, plans))
+        ]
 
 
 def create_agent_team() -> HierarchicalAgentTeam:
@@ -865,11 +1591,41 @@ class TaskScheduler:
             agent_team: 智能体团队实例
         """
         self.agent_team = agent_team
+        # 任务结果缓存：键为任务指纹，值为 (写入时间, 输出帧列表)
+        self._frame_cache: "OrderedDict[bytes, tuple[float, list]]" = OrderedDict()
+
+    @staticmethod
+    def _cache_key(task: str, enable_streaming: bool) -> bytes:
+        """任务指纹：任务文本 + 是否流式 + 模型与提示词指纹"""
+        content = f"{task}|{enable_streaming}|{_TASK_FINGERPRINT}"
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[list]:
+        """读取未过期的缓存帧"""
+        entry = self._frame_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > HAT_CACHE_TTL:
+            del self._frame_cache[key]
+            return None
+        self._frame_cache.move_to_end(key)
+        return entry[1]
+
+    def _cache_put(self, key: bytes, frames: list):
+        """写入缓存，超出容量时淘汰最久未使用的任务"""
+        self._frame_cache[key] = (time.monotonic(), frames)
+        self._frame_cache.move_to_end(key)
+        while len(self._frame_cache) > HAT_CACHE_SIZE:
+            self._frame_cache.popitem(last=False)
 
     async def receive_task(self, task: str, enable_streaming: bool = True):
         """
         接收用户任务并调度执行
 
+        相同任务在缓存有效期内直接回放上次的输出帧（时间戳更新为当前时间），
+        不再执行图；执行出错（包括智能体出错）、没有产生结果或中途断开的运行不会被缓存。
+        缓存在输出结束帧之前写入，消费端收到结束帧后即使不再继续迭代也能命中。
+
         Args:
             task: 用户提交的任务
             enable_streaming: 是否启用流式输出
@@ -877,28 +1633,54 @@ class TaskScheduler:
         Yields:
             任务执行过程的流式输出
         """
+        if HAT_CACHE_SIZE <= 0:
+            async for frame in self._run_task(task, enable_streaming):
+                yield frame
+            return
+
+        key = self._cache_key(task, enable_streaming)
+        cached = self._cache_get(key)
+        if cached is not None:
+            for n, frame in enumerate(cached, 1):
+                yield frame | {"timestamp": now_iso()}
+                if n % _YIELD_EVERY_CHUNKS == 0:
+                    await asyncio.sleep(0)
+            return
+
+        frames = []
+        failed = stored = False
+        has_result = False
+        async for frame in self._run_task(task, enable_streaming):
+            frames.append(frame)
+            frame_type = frame.get("type")
+            failed = failed or frame_type == "error"
+            has_result = has_result or frame_type == "result"
+            if frame_type == "end" and has_result and not failed:
+                self._cache_put(key, frames)
+                stored = True
+            yield frame
+        # 非流式执行不输出结束帧，完整迭代后再写入
+        if has_result and not failed and not stored:
+            self._cache_put(key, frames)
+
+    async def _run_task(self, task: str, enable_streaming: bool):
+        """执行任务并输出流式帧（不经过缓存）"""
         try:
             # 步骤 1: 任务调度器接收任务
             if enable_streaming:
-                yield {
+                yield _SCHEDULER_FRAME | {
                     "type": "status",
-                    "agent": "任务调度器",
                     "message": f"📥 接收任务：{task}",
-                    "node": "scheduler",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.05)
 
             # 步骤 2: 调用主管进行任务分析并编排执行流程
             if enable_streaming:
-                yield {
+                yield _SCHEDULER_FRAME | {
                     "type": "thinking",
-                    "agent": "任务调度器",
                     "message": "🤖 正在调用一级主管进行任务分析并编排执行流程...",
-                    "node": "scheduler",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.05)
 
             # 步骤 3: 初始化任务状态
             initial_state = {"messages": [HumanMessage(content=task)]}
@@ -907,141 +1689,49 @@ class TaskScheduler:
             agents_called = set()  # 记录所有被调用的智能体
 
             if enable_streaming:
-                yield {
+                yield _SCHEDULER_FRAME | {
                     "type": "status",
-                    "agent": "任务调度器",
                     "message": "🚀 启动智能体团队，实时追踪执行过程...",
-                    "node": "scheduler",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.05)
-
-            # 使用 astream 实时追踪所有节点的执行（包括第3级智能体）
-            async for chunk in self.agent_team.graph.astream(initial_state, config={"recursion_limit": 150}):
-                for node_name, output in chunk.items():
-                    display_name = self.agent_team._get_node_display_name(node_name)
-
-                    # 记录被调用的智能体
-                    if hasattr(output, 'get') and isinstance(output, dict):
-                        if 'messages' in output:
-                            for msg in output['messages']:
-                                if hasattr(msg, 'name') and msg.name:
-                                    agents_called.add(msg.name)
-
-                    # 为每个节点创建独立的消息框
-                    if enable_streaming:
-                        # 节点开始执行
-                        yield {
-                            "type": "thinking",
-                            "agent": display_name,
-                            "message": f"⚙️ 正在执行 {display_name} 任务...",
-                            "node": node_name,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        await asyncio.sleep(0.05)
-
-                        # 输出结果内容（真实流式输出）
-                        if hasattr(output, 'get') and isinstance(output, dict):
-                            if 'messages' in output:
-                                for msg in output['messages']:
-                                    if hasattr(msg, 'content') and msg.content:
-                                        # 检查是否有流式块（来自OpenAI的真正流式内容）
-                                        if (hasattr(msg, 'additional_kwargs') and
-                                            msg.additional_kwargs.get('is_streaming') and
-                                            'streaming_chunks' in msg.additional_kwargs):
-
-                                            # 真正的OpenAI流式输出：逐个输出流式块
-                                            streaming_chunks = msg.additional_kwargs['streaming_chunks']
-                                            for chunk in streaming_chunks:
-                                                if chunk:  # 确保块不为空
-                                                    yield {
-                                                        "type": "result",
-                                                        "agent": display_name,
-                                                        "message": chunk,
-                                                        "node": node_name,
-                                                        "timestamp": datetime.now().isoformat(),
-                                                        "is_real_streaming": True  # 标记为真正的OpenAI流式输出
-                                                    }
-                                                    await asyncio.sleep(0.01)  # 短暂延迟以实现流式效果
-                                        else:
-                                            # 非流式输出：根据内容长度决定输出方式
-                                            content_length = len(msg.content)
-                                            if content_length > 100:
-                                                # 长内容：分块流式输出（模拟）
-                                                words = msg.content.split()
-                                                chunk_size = min(8, max(3, len(words) // 15))
-                                                for i in range(0, len(words), chunk_size):
-                                                    word_chunk = " ".join(words[i:i+chunk_size])
-                                                    yield {
-                                                        "type": "result",
-                                                        "agent": display_name,
-                                                        "message": word_chunk,
-                                                        "node": node_name,
-                                                        "timestamp": datetime.now().isoformat()
-                                                    }
-                                                    await asyncio.sleep(0.03)
-                                            else:
-                                                # 短内容：直接输出
-                                                yield {
-                                                    "type": "result",
-                                                    "agent": display_name,
-                                                    "message": msg.content,
-                                                    "node": node_name,
-                                                    "timestamp": datetime.now().isoformat()
-                                                }
-                                                await asyncio.sleep(0.05)
-
-                        # 节点完成
-                        yield {
-                            "type": "status",
-                            "agent": display_name,
-                            "message": f"✅ {display_name} 执行完成",
-                            "node": node_name,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        await asyncio.sleep(0.05)
+
+            # 直接转发图执行事件：模型 token 到达即输出，不再等节点返回后回放；
+            # result 帧按节点在短时间窗口内合并，减少 SSE 帧数
+            frames = self.agent_team._graph_frames(initial_state, agents_called, enable_streaming)
+            async for frame in _StreamBatcher().batch(frames):
+                yield frame
 
             # 步骤 5: 调度器汇总执行结果
             if enable_streaming:
-                yield {
+                yield _SCHEDULER_FRAME | {
                     "type": "thinking",
-                    "agent": "任务调度器",
                     "message": "📊 汇总执行结果...",
-                    "node": "scheduler",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
-                await asyncio.sleep(0.05)
 
                 # 显示实际调用的智能体列表
-                agent_names = [self.agent_team._get_node_display_name(agent) for agent in agents_called if agent in ['supervisor', 'research_team', 'document_writing_team', 'searcher', 'web_crawler', 'writer', 'outline', 'chart_generator']]
+                agent_names = [_DISPLAY_NAMES.get(agent, agent) for agent in agents_called & _SUMMARY_AGENTS]
                 if agent_names:
                     summary_message = f"📋 **任务执行完成**\n\n✅ 成功调用 {len(agent_names)} 个智能体：\n" + "\n".join([f"  • {name}" for name in agent_names])
-                    yield {
+                    yield _SCHEDULER_FRAME | {
                         "type": "final",
-                        "agent": "任务调度器",
                         "message": summary_message,
-                        "node": "scheduler",
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": now_iso()
                     }
-                    await asyncio.sleep(0.05)
 
             # 结束任务
             if enable_streaming:
-                yield {
+                yield _SCHEDULER_FRAME | {
                     "type": "end",
-                    "agent": "任务调度器",
                     "message": "✨ 任务执行完成",
-                    "node": "scheduler",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso()
                 }
 
         except Exception as e:
-            yield {
+            yield _SCHEDULER_FRAME | {
                 "type": "error",
-                "agent": "任务调度器",
                 "message": f"❌ 任务调度执行出错: {str(e)}",
-                "node": "scheduler",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso()
             }
 
     async def execute_sync(self, task: str):
@@ -1052,37 +1742,44 @@ class TaskScheduler:
             task: 用户任务
 
         Returns:
-            执行结果
+            执行结果；有智能体出错或没有产生任何结果时 success 为 False
         """
         results = []
         async for data in self.receive_task(task, enable_streaming=False):
             results.append(data)
 
-        # 提取最终结果
-        final_messages = []
+        # 提取最终结果：同一节点的 token 帧原样拼接，各节点之间空行分隔
+        node_outputs: Dict[Any, List[str]] = {}
         for result in results:
             if result.get("type") == "result":
-                final_messages.append(result.get("message", ""))
+                node_outputs.setdefault(result.get("node"), []).append(result.get("message", ""))
+        final_messages = ["".join(parts) for parts in node_outputs.values()]
+
+        # 有智能体出错或没有任何结果时视为失败
+        failed = any(result.get("type") == "error" for result in results)
 
         return {
             "task": task,
             "result": "\n\n".join(final_messages) if final_messages else "任务执行完成",
             "steps": results,
-            "success": True
+            "success": bool(final_messages) and not failed
         }
 
 
-def create_task_scheduler(agent_team: HierarchicalAgentTeam = None):
+def create_task_scheduler(agent_team: HierarchicalAgentTeam):
     """
     创建任务调度器实例
 
     Args:
-        agent_team: 智能体团队实例，如果为None则创建新的
+        agent_team: 进程内共享的智能体团队实例
 
     Returns:
         任务调度器实例
+
+    Raises:
+        ValueError: 未传入智能体团队时抛出，避免静默创建第二个团队
     """
     if agent_team is None:
-        agent_team = create_agent_team()
+        raise ValueError("create_task_scheduler 需要传入已创建的智能体团队实例")
 
     return TaskScheduler(agent_team)
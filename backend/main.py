@@ -16,23 +16,24 @@ FastAPI 主应用文件
 """
 
 import os
-import asyncio
+import sys
+import logging
 from typing import Dict, Any
 
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+import orjson
+from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import uvicorn
 
 # 导入本地模块
-from hierarchical_agent_teams import create_agent_team, HierarchicalAgentTeam, create_task_scheduler
+from hierarchical_agent_teams import create_agent_team, HierarchicalAgentTeam, create_task_scheduler, shutdown
 from streaming import (
-    stream_manager,
     create_streaming_response,
-    process_agent_stream,
     create_error_response,
     validate_task_input
 )
+from timeutil import now_iso
 
 
 # ==============================================================================
@@ -64,6 +65,12 @@ class HealthResponse(BaseModel):
 # 2. FastAPI 应用初始化
 # ==============================================================================
 
+# 日志配置（各模块只获取 logger，不在模块内配置输出）
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+)
+
 app = FastAPI(
     title="分层智能体团队 API",
     description="基于 LangGraph 的分层智能体团队系统，支持流式响应",
@@ -98,103 +105,107 @@ task_scheduler = create_task_scheduler(agent_team)
 # 4. API 端点
 # ==============================================================================
 
-@app.get("/health", response_model=HealthResponse, tags=["系统"])
-async def health_check():
-    """健康检查端点"""
-    return HealthResponse(
-        status="healthy",
-        version="1.0.0",
-        timestamp="2025-12-09"
-    )
-
-
-@app.get("/agents", response_model=Dict[str, Any], tags=["智能体团队"])
-async def get_agents():
-    """获取可用智能体列表（基于官方 LangGraph 教程三层结构）"""
-    return {
-        "layer_1": {
-            "name": "第1层 - 主管",
-            "nodes": {
-                "supervisor": {
-                    "name": "主管",
-                    "role": "Top-level Supervisor",
-                    "description": "负责任务分配和团队协调",
-                    "layer": 1
-                }
+# 健康检查响应中除时间戳外的部分固定，预先序列化为字节前缀
+_HEALTH_PREFIX = orjson.dumps({"status": "healthy", "version": "1.0.0"})[:-1] + b',"timestamp":'
+
+# 智能体列表为静态数据，模块加载时序列化一次，每次请求直接返回字节
+_AGENTS = {
+    "layer_1": {
+        "name": "第1层 - 主管",
+        "nodes": {
+            "supervisor": {
+                "name": "主管",
+                "role": "Top-level Supervisor",
+                "description": "负责任务分配和团队协调",
+                "layer": 1
             }
-        },
-        "layer_2": {
-            "name": "第2层 - 团队",
-            "nodes": {
-                "research_team": {
-                    "name": "研究团队",
-                    "role": "Research Team Supervisor",
-                    "description": "协调研究团队内部工作",
-                    "layer": 2,
-                    "members": {
-                        "search_team": {
-                            "name": "搜索团队",
-                            "layer": 3,
-                            "description": "负责搜索和信息提取"
-                        }
+        }
+    },
+    "layer_2": {
+        "name": "第2层 - 团队",
+        "nodes": {
+            "research_team": {
+                "name": "研究团队",
+                "role": "Research Team Supervisor",
+                "description": "协调研究团队内部工作",
+                "layer": 2,
+                "members": {
+                    "search_team": {
+                        "name": "搜索团队",
+                        "layer": 3,
+                        "description": "负责搜索和信息提取"
                     }
-                },
-                "document_writing_team": {
-                    "name": "文档写作团队",
-                    "role": "Document Writing Team Supervisor",
-                    "description": "协调文档写作团队内部工作",
-                    "layer": 2,
-                    "members": {
-                        "writing_team": {
-                            "name": "写作团队",
-                            "layer": 3,
-                            "description": "负责文档创作和可视化"
-                        }
+                }
+            },
+            "document_writing_team": {
+                "name": "文档写作团队",
+                "role": "Document Writing Team Supervisor",
+                "description": "协调文档写作团队内部工作",
+                "layer": 2,
+                "members": {
+                    "writing_team": {
+                        "name": "写作团队",
+                        "layer": 3,
+                        "description": "负责文档创作和可视化"
                     }
                 }
             }
-        },
-        "layer_3": {
-            "name": "第3层 - 执行节点",
-            "nodes": {
-                "searcher": {
-                    "name": "网页搜索智能体",
-                    "role": "Search Specialist",
-                    "description": "负责网络搜索和信息查找",
-                    "tools": ["web_search"],
-                    "layer": 3
-                },
-                "web_crawler": {
-                    "name": "网页爬取智能体",
-                    "role": "Web Crawler Specialist",
-                    "description": "负责网页内容抓取",
-                    "tools": ["web_crawler"],
-                    "layer": 3
-                },
-                "writer": {
-                    "name": "文档写作智能体",
-                    "role": "Writing Specialist",
-                    "description": "负责文档撰写",
-                    "tools": ["write_document", "read_document", "create_outline"],
-                    "layer": 3
-                },
-                "outline": {
-                    "name": "大纲生成智能体",
-                    "role": "Outline Generation Specialist",
-                    "description": "负责创建文档大纲",
-                    "tools": ["create_outline"],
-                    "layer": 3
-                },
-                "chart_generator": {
-                    "name": "图表生成智能体",
-                    "role": "Chart Generation Specialist",
-                    "description": "负责数据可视化",
-                    "tools": ["generate_chart"],
-                    "layer": 3
-                }
+        }
+    },
+    "layer_3": {
+        "name": "第3层 - 执行节点",
+        "nodes": {
+            "searcher": {
+                "name": "网页搜索智能体",
+                "role": "Search Specialist",
+                "description": "负责网络搜索和信息查找",
+                "tools": ["web_search"],
+                "layer": 3
+            },
+            "web_crawler": {
+                "name": "网页爬取智能体",
+                "role": "Web Crawler Specialist",
+                "description": "负责网页内容抓取",
+                "tools": ["web_crawler"],
+                "layer": 3
+            },
+            "writer": {
+                "name": "文档写作智能体",
+                "role": "Writing Specialist",
+                "description": "负责文档撰写",
+                "tools": ["write_document", "read_document", "create_outline"],
+                "layer": 3
+            },
+            "outline": {
+                "name": "大纲生成智能体",
+                "role": "Outline Generation Specialist",
+                "description": "负责创建文档大纲",
+                "tools": ["create_outline"],
+                "layer": 3
+            },
+            "chart_generator": {
+                "name": "图表生成智能体",
+                "role": "Chart Generation Specialist",
+                "description": "负责数据可视化",
+                "tools": ["generate_chart"],
+                "layer": 3
             }
         }
     }
+}
+_AGENTS_JSON = orjson.dumps(_AGENTS)
+
+
+@app.get("/health", response_model=HealthResponse, tags=["系统"])
+async def health_check():
+    """健康检查端点"""
+    return Response(content=_HEALTH_PREFIX + orjson.dumps(now_iso()) + b"}", media_type="application/json")
+
+
+@app.get("/agents", response_model=Dict[str, Any], tags=["智能体团队"])
+async def get_agents():
+    """获取可用智能体列表（基于官方 LangGraph 教程三层结构）"""
+    return Response(content=_AGENTS_JSON, media_type="application/json")
 
 
 @app.post("/chat", response_model=ChatResponse, tags=["聊天"])
@@ -214,14 +225,14 @@ async def chat_sync(request: ChatRequest):
         result = await task_scheduler.execute_sync(request.task)
 
         return ChatResponse(
-            success=True,
-            message="任务执行完成",
+            success=result["success"],
+            message="任务执行完成" if result["success"] else "任务执行失败",
             data={
                 "task": request.task,
                 "result": result["result"],
                 "steps": result["steps"]
             },
-            timestamp="2025-12-10"
+            timestamp=now_iso()
         )
 
     except Exception as e:
@@ -229,72 +240,32 @@ async def chat_sync(request: ChatRequest):
             success=False,
             message=f"任务执行失败: {str(e)}",
             data={},
-            timestamp="2025-12-10"
+            timestamp=now_iso()
         )
 
 
 @app.post("/stream-chat", tags=["聊天"])
-async def chat_stream(request: ChatRequest):
+@app.post("/stream-chat/v2", include_in_schema=False)
+async def chat_stream(request: Request, chat_request: ChatRequest):
     """
     流式聊天端点（SSE）
 
-    主要端点：
     1. 验证输入任务
-    2. 创建流式连接
-    3. 启动后台任务处理
-    4. 返回 SSE 响应
-    """
-    # 验证输入
-    validation_error = validate_task_input(request.task)
-    if validation_error:
-        raise HTTPException(status_code=400, detail=validation_error)
-
-    # 创建流式连接
-    stream_id = stream_manager.create_stream()
+    2. 将任务调度器的帧生成器直接作为 SSE 响应返回
 
-    # 创建后台任务处理智能体团队流
-    background_task = asyncio.create_task(
-        process_agent_stream(request.task, stream_id, agent_team)
-    )
-
-    # 创建并返回 SSE 响应
-    # 注意：需要在请求对象中传递
-    # 实际中需要通过依赖注入获取
-    return create_streaming_response(stream_id, Request({"type": "http"}))
-
-
-# 更实用的实现（通过依赖注入获取 Request）
-from fastapi import Depends
-
-async def get_request() -> Request:
-    """获取当前请求对象（依赖注入）"""
-    # 这里需要 FastAPI 的 Request 对象
-    # 在实际应用中通过 Depends 注入
-    pass
-
-
-# 重新定义流式端点（使用更实用的方式）
-@app.post("/stream-chat/v2", tags=["聊天"])
-async def chat_stream_v2(request: Request, chat_request: ChatRequest):
-    """
-    流式聊天端点（推荐使用）
+    /stream-chat/v2 为兼容旧版前端保留的别名
     """
     # 验证输入
     validation_error = validate_task_input(chat_request.task)
     if validation_error:
         raise HTTPException(status_code=400, detail=validation_error)
 
-    # 创建流式连接
-    stream_id = stream_manager.create_stream()
-
-    # 创建后台任务
-    background_task = asyncio.create_task(
-        process_agent_stream(chat_request.task, stream_id, task_scheduler)
+    # 返回 SSE 响应（客户端断开时随响应一起取消任务）
+    return create_streaming_response(
+        task_scheduler.receive_task(chat_request.task, enable_streaming=True),
+        request
     )
 
-    # 返回 SSE 响应
-    return create_streaming_response(stream_id, request)
-
 
 # ==============================================================================
 # 5. 启动配置
@@ -317,10 +288,16 @@ async def startup_event():
     if not os.getenv("TAVILY_API_KEY"):
         print("⚠️  警告: 未检测到 TAVILY_API_KEY")
 
+    # 预热进程内唯一智能体团队的提示词缓存和 HTTP 连接池
+    await agent_team.warmup()
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
+    # 路由缓存落盘，关闭共享的 HTTP 连接池
+    await shutdown()
+
     print("=" * 60)
     print("🛑 分层智能体团队 API 已关闭")
     print("=" * 60)
@@ -331,11 +308,21 @@ async def shutdown_event():
 # ==============================================================================
 
 if __name__ == "__main__":
-    # 使用 uvicorn 启动应用
+    # 开发时设置 HAT_RELOAD=1 开启热重载（热重载只支持单进程）
+    reload = os.getenv("HAT_RELOAD", "0") == "1"
+    # 默认单进程。HAT_WORKERS>1 时每个进程各自预热并持有独立的任务缓存与路由缓存，
+    # 缓存互不共享；路由缓存关闭时各进程覆盖写同一个 .npz 文件，最后退出的进程生效
+    workers = int(os.getenv("HAT_WORKERS", "1"))
+
+    # 使用 uvicorn 启动应用：uvloop 事件循环 + httptools 解析器（Windows 不支持 uvloop）
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=reload,
+        workers=1 if reload else workers,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        timeout_keep_alive=75,  # SSE 长连接，延长 keep-alive
         log_level="info"
     )
@@ -0,0 +1,82 @@
+"""
+测试公共配置
+
+模块导入时即创建 OpenAI 客户端并编译图，因此在导入被测模块之前设置
+占位 API Key，并把路由缓存目录指向临时目录；所有 LLM 调用都替换为假模型。
+"""
+
+import os
+import sys
+import tempfile
+from itertools import cycle
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("HAT_ROUTE_CACHE_DIR", tempfile.mkdtemp(prefix="hat_route_cache_"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+
+import hierarchical_agent_teams as hat  # noqa: E402
+
+
+class FakeStructuredLLM:
+    """结构化输出的假模型：按顺序返回预设结果，并记录调用次数和最近一次输入"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.last_input = None
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        self.last_input = messages
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class CountingTeam:
+    """按预设帧执行图的智能体团队，记录执行次数"""
+
+    def __init__(self, *frames):
+        self.frames = frames or ({"type": "result", "agent": "搜索专家", "message": "结果", "node": "searcher"},)
+        self.runs = 0
+
+    async def _graph_frames(self, initial_state, agents_called, enable_streaming):
+        self.runs += 1
+        agents_called.add("searcher")
+        for frame in self.frames:
+            yield dict(frame, timestamp=hat.now_iso())
+
+
+@pytest.fixture
+def fake_final_llm(monkeypatch):
+    """把各智能体使用的 final_llm 替换为逐词流式输出固定内容的假模型"""
+    model = GenericFakeChatModel(messages=cycle([AIMessage(content="假 模型 输出")]))
+    fake = model.with_config(tags=["final"])
+    monkeypatch.setattr(hat, "final_llm", fake)
+    return fake
+
+
+@pytest.fixture
+def failing_final_llm(monkeypatch):
+    """把各智能体使用的 final_llm 替换为调用即抛出异常的假模型"""
+    fake = FakeStructuredLLM(RuntimeError("模型不可用"))
+    monkeypatch.setattr(hat, "final_llm", fake)
+    return fake
+
+
+@pytest.fixture
+def fake_planner(monkeypatch):
+    """用给定的计划步骤替换规划器"""
+    def install(*steps):
+        planner = FakeStructuredLLM({"steps": list(steps)})
+        monkeypatch.setattr(hat, "planner_llm", planner)
+        return planner
+
+    return install
@@ -0,0 +1,50 @@
+"""HierarchicalAgentTeam 的流式输出"""
+
+from itertools import cycle
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Command
+
+import hierarchical_agent_teams as hat
+
+
+def _searcher_graph():
+    """搜索智能体 + 一个调用未打标签模型的汇总节点"""
+    router = GenericFakeChatModel(messages=cycle([AIMessage(content="路由 决策")]))
+
+    async def merge(state: hat.State) -> Command[hat.Literal["__end__"]]:
+        await router.ainvoke(state["messages"])
+        return Command(goto=END)
+
+    builder = StateGraph(hat.State)
+    builder.add_node("searcher", hat.searcher_node)
+    builder.add_node("merge", merge)
+    builder.add_edge(START, "searcher")
+    return builder.compile()
+
+
+async def test_stream_forwards_only_tagged_worker_tokens(fake_final_llm):
+    team = hat.create_agent_team()
+    team.graph = _searcher_graph()
+
+    frames = [frame async for frame in team.process_task_stream("调研 AI 智能体")]
+
+    results = [frame for frame in frames if frame["type"] == "result"]
+    assert "".join(frame["message"] for frame in results) == "假 模型 输出"
+    assert {frame["node"] for frame in results} == {"searcher"}
+    assert len(results) < 5  # 逐词 token 被合并
+    assert frames[-1]["type"] == "end"
+
+
+async def test_worker_error_streamed_as_error_frame(failing_final_llm, fake_planner):
+    fake_planner({"agent": "searcher", "depends_on": []})
+    team = hat.create_agent_team()
+
+    frames = [frame async for frame in team.process_task_stream("调研 AI 智能体")]
+
+    searcher = [frame for frame in frames if frame.get("node") == "searcher"]
+    assert [frame["type"] for frame in searcher] == ["thinking", "error"]
+    assert "模型不可用" in searcher[-1]["message"]
+    assert frames[-1]["type"] == "end"
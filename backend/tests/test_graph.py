@@ -0,0 +1,111 @@
+"""智能体图的编译与分发"""
+
+from langchain_core.messages import HumanMessage
+
+import hierarchical_agent_teams as hat
+from conftest import FakeStructuredLLM
+
+
+def test_graphs_compile():
+    nodes = set(hat.planner_graph.get_graph().nodes)
+    assert {"planner", "plan_executor", *hat.PLANNER_AGENTS} <= nodes
+    # 旧版层级图按需构建，只构建一次
+    nodes = set(hat.get_super_graph().get_graph().nodes)
+    assert {"supervisor", "research_team", "document_writing_team"} <= nodes
+    assert hat.get_super_graph() is hat.get_super_graph()
+
+
+def test_parallel_dispatch_fans_out_both_teams():
+    state = {"messages": [HumanMessage(content="任务")]}
+    sends = hat.parallel_dispatch(state)
+    assert [send.node for send in sends] == ["research_team", "document_writing_team"]
+    assert all(send.arg["messages"] == state["messages"] for send in sends)
+
+
+def test_research_dispatch_fans_out_in_parallel():
+    state = {"messages": [HumanMessage(content="任务")]}
+    assert [send.node for send in hat.research_dispatch(state)] == ["searcher", "web_crawler"]
+
+
+async def test_research_team_merges_parallel_branches(fake_final_llm):
+    result = await hat._build_research_team_graph().ainvoke({"messages": [HumanMessage(content="调研")]})
+
+    assert [msg.name for msg in result["merge_msgs"]] == ["merge"]
+    assert result["merge_msgs"][-1].content == "假 模型 输出"
+    # 共享 messages 只保留路由标记
+    assert {msg.content for msg in result["messages"][1:]} == {
+        f"{agent} 已完成" for agent in ("searcher", "web_crawler", "merge")
+    }
+    assert hat._latest_message(result) is result["merge_msgs"][-1]
+
+
+def test_plan_step_keeps_wrapper_annotation():
+    wrapper = hat._plan_step(hat.writer_node)
+    assert wrapper.__name__ == "writer_node"
+    assert not hasattr(wrapper, "__wrapped__")
+    assert "plan_executor" in str(wrapper.__annotations__["return"])
+
+
+def test_planner_binds_strict_json_schema():
+    response_format = hat.planner_llm.first.kwargs["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
+
+
+def test_normalize_plan_drops_unknown_agents_and_forward_deps():
+    plan = hat._normalize_plan([
+        {"agent": "searcher", "depends_on": [1]},
+        {"agent": "unknown", "depends_on": []},
+        {"agent": "merge", "depends_on": [0, 1, 5]},
+    ])
+    assert plan == [
+        {"agent": "searcher", "depends_on": []},
+        {"agent": "merge", "depends_on": [0]},
+    ]
+
+
+async def test_planner_falls_back_to_default_plan_on_error(monkeypatch):
+    monkeypatch.setattr(hat, "planner_llm", FakeStructuredLLM(RuntimeError("boom")))
+    command = await hat.planner_node({"messages": [HumanMessage(content="任务")]})
+    assert command.update["plan"] == [dict(step) for step in hat.DEFAULT_PLAN]
+
+
+def test_plan_executor_dispatches_ready_steps_as_one_wave():
+    state = {
+        "messages": [HumanMessage(content="任务")],
+        "plan": [
+            {"agent": "searcher", "depends_on": []},
+            {"agent": "web_crawler", "depends_on": []},
+            {"agent": "merge", "depends_on": [0, 1]},
+        ],
+        "plan_done": [],
+    }
+    command = hat.plan_executor_node(state)
+    assert [send.node for send in command.goto] == ["searcher", "web_crawler"]
+    assert [send.arg["plan_step"] for send in command.goto] == [0, 1]
+
+    command = hat.plan_executor_node({**state, "plan_done": [0, 1]})
+    assert [send.node for send in command.goto] == ["merge"]
+
+    command = hat.plan_executor_node({**state, "plan_done": [0, 1, 2]})
+    assert command.goto == hat.END
+
+
+async def test_plan_pipeline_runs_end_to_end(fake_final_llm, fake_planner):
+    fake_planner(
+        {"agent": "searcher", "depends_on": []},
+        {"agent": "web_crawler", "depends_on": []},
+        {"agent": "merge", "depends_on": [0, 1]},
+        {"agent": "writer", "depends_on": [2]},
+    )
+    result = await hat.planner_graph.ainvoke(
+        {"messages": [HumanMessage(content="调研 AI 智能体并写一份报告")]},
+        config={"recursion_limit": hat.RECURSION_LIMIT},
+    )
+
+    assert sorted(result["plan_done"]) == [0, 1, 2, 3]
+    for agent in ("searcher", "web_crawler", "merge", "writer"):
+        assert result[f"{agent}_msgs"][-1].content == "假 模型 输出"
+    assert {msg.content for msg in result["messages"][1:]} == {
+        f"{agent} 已完成" for agent in ("searcher", "web_crawler", "merge", "writer")
+    }
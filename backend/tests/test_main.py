@@ -0,0 +1,57 @@
+"""HTTP 端点"""
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client():
+    # 不触发启动事件（预热会请求 OpenAI）
+    return TestClient(main.app)
+
+
+def test_health(client):
+    response = client.get("/health")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "healthy" and body["version"] == "1.0.0" and body["timestamp"]
+
+
+def test_agents_served_from_cached_bytes(client):
+    response = client.get("/agents")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == main._AGENTS_JSON
+    assert response.json() == main._AGENTS
+
+
+def test_stream_chat_rejects_malicious_input(client):
+    response = client.post("/stream-chat", json={"task": "<script>alert(1)</script>"})
+    assert response.status_code == 400
+
+
+def test_stream_chat_streams_sse_frames(client, fake_final_llm, fake_planner, monkeypatch):
+    fake_planner({"agent": "searcher", "depends_on": []})
+    monkeypatch.setattr(main, "task_scheduler", main.create_task_scheduler(main.agent_team))
+
+    response = client.post("/stream-chat", json={"task": "调研 AI 智能体"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = [orjson.loads(line[6:]) for line in response.text.split("\n") if line.startswith("data: ")]
+    assert frames[0]["type"] == "connection"
+    assert frames[-1]["type"] == "end"
+    assert "".join(f["message"] for f in frames if f["type"] == "result") == "假 模型 输出"
+
+
+def test_chat_reports_worker_failure(client, failing_final_llm, fake_planner, monkeypatch):
+    fake_planner({"agent": "searcher", "depends_on": []})
+    monkeypatch.setattr(main, "task_scheduler", main.create_task_scheduler(main.agent_team))
+
+    response = client.post("/chat", json={"task": "调研 AI 智能体"})
+
+    assert response.status_code == 200
+    assert response.json()["success"] is False
@@ -0,0 +1,58 @@
+"""语义路由缓存"""
+
+import numpy as np
+
+import hierarchical_agent_teams as hat
+
+
+def _unit(*values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_lookup_respects_threshold(tmp_path):
+    cache = hat.RouteCache("writer,outline", threshold=0.9, cache_dir=str(tmp_path))
+    cache.add(_unit(1, 0), "", "writer")
+
+    assert cache.lookup(_unit(1, 0.1), "") == "writer"
+    assert cache.lookup(_unit(0, 1), "") is None
+    assert cache.lookup(_unit(1, 0, 0), "") is None  # 维度不一致
+
+
+def test_lookup_requires_identical_progress(tmp_path):
+    cache = hat.RouteCache("writer,outline", cache_dir=str(tmp_path))
+    cache.add(_unit(1, 0), "", "outline")
+    cache.add(_unit(1, 0), "outline", "writer")
+
+    assert cache.lookup(_unit(1, 0), "") == "outline"
+    assert cache.lookup(_unit(1, 0), "outline") == "writer"
+    assert cache.lookup(_unit(1, 0), "outline -> writer") is None
+
+
+def test_add_evicts_oldest_entries(tmp_path):
+    cache = hat.RouteCache("writer,outline", cache_dir=str(tmp_path), max_entries=2)
+    for decision, vector in (("a", _unit(1, 0, 0)), ("b", _unit(0, 1, 0)), ("c", _unit(0, 0, 1))):
+        cache.add(vector, decision, decision)
+
+    assert cache.decisions == ["b", "c"]
+    assert cache.progress == ["b", "c"]
+    assert cache.vectors.shape == (2, 3)
+    assert cache.lookup(_unit(1, 0, 0), "a") is None
+
+
+async def test_entries_persist_only_on_flush(tmp_path):
+    cache = hat.RouteCache("writer,outline", cache_dir=str(tmp_path))
+    cache.add(_unit(1, 0), "outline", "writer")
+    assert not list(tmp_path.iterdir())
+
+    await cache.flush()
+    restored = hat.RouteCache("writer,outline", cache_dir=str(tmp_path), max_entries=1)
+    assert restored.decisions == ["writer"]
+    assert restored.lookup(_unit(1, 0), "outline") == "writer"
+
+
+def test_files_without_progress_are_ignored(tmp_path):
+    cache = hat.RouteCache("writer,outline", cache_dir=str(tmp_path))
+    np.savez(cache.path, vectors=_unit(1, 0)[None, :], decisions=np.array(["writer"]))
+
+    assert hat.RouteCache("writer,outline", cache_dir=str(tmp_path)).decisions == []
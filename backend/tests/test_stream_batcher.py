@@ -0,0 +1,78 @@
+"""result 帧批处理的输出规则"""
+
+import asyncio
+
+import pytest
+
+import hierarchical_agent_teams as hat
+
+
+def _result(node: str, message: str) -> dict:
+    return {"type": "result", "agent": node, "message": message, "node": node, "timestamp": "t"}
+
+
+async def _frames(*items):
+    """依次输出帧；数字表示在该位置等待的秒数"""
+    for item in items:
+        if isinstance(item, (int, float)):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def _collect(*items, **kwargs):
+    return [frame async for frame in hat._StreamBatcher(**kwargs).batch(_frames(*items))]
+
+
+async def test_flushes_after_max_chunks():
+    out = await _collect(*(_result("searcher", str(i)) for i in range(10)))
+    assert [frame["message"] for frame in out] == ["01234567", "89"]
+
+
+async def test_flushes_when_interval_elapses():
+    out = await _collect(_result("searcher", "a"), _result("searcher", "b"), 0.2, _result("searcher", "c"))
+    assert [frame["message"] for frame in out] == ["ab", "c"]
+
+
+@pytest.mark.parametrize("frame_type", ["status", "end", "error"])
+async def test_flushes_immediately_before_control_frames(frame_type):
+    control = {"type": frame_type, "agent": "系统", "message": frame_type, "timestamp": "t"}
+    out = await _collect(_result("searcher", "a"), _result("searcher", "b"), control)
+    assert [frame["message"] for frame in out] == ["ab", frame_type]
+
+
+async def test_interleaved_nodes_are_merged_per_node():
+    items = []
+    for i in range(3):
+        items += [_result("searcher", f"s{i}"), _result("web_crawler", f"w{i}")]
+    out = await _collect(*items)
+    assert {frame["node"]: frame["message"] for frame in out} == {
+        "searcher": "s0s1s2",
+        "web_crawler": "w0w1w2",
+    }
+    assert len(out) == 2
+
+
+async def test_buffered_frames_flushed_before_upstream_error():
+    async def failing():
+        yield _result("searcher", "a")
+        raise RuntimeError("boom")
+
+    out = []
+    with pytest.raises(RuntimeError):
+        async for frame in hat._StreamBatcher().batch(failing()):
+            out.append(frame)
+    assert [frame["message"] for frame in out] == ["a"]
+
+
+async def test_served_path_streams_merged_tokens(fake_final_llm, fake_planner):
+    fake_planner({"agent": "searcher", "depends_on": []})
+    scheduler = hat.TaskScheduler(hat.create_agent_team())
+
+    frames = [frame async for frame in scheduler.receive_task("调研 AI 智能体")]
+
+    results = [frame for frame in frames if frame["type"] == "result"]
+    assert "".join(frame["message"] for frame in results) == "假 模型 输出"
+    assert len(results) < 5  # 逐词 token 被合并
+    assert all(frame["is_real_streaming"] and frame["node"] == "searcher" for frame in results)
+    assert frames[-1]["type"] == "end"
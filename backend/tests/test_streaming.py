@@ -0,0 +1,140 @@
+"""SSE 适配层"""
+
+import asyncio
+import json
+
+import orjson
+import pytest
+from starlette.requests import Request
+
+import hierarchical_agent_teams as hat
+from streaming import format_sse_data, sse_adapter
+from conftest import CountingTeam
+
+
+def _request(disconnected: bool = False) -> Request:
+    """构造 ASGI 请求；disconnected=True 时客户端立即断开，否则一直保持连接"""
+    async def receive():
+        if disconnected:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "POST", "headers": []}, receive)
+
+
+def _decode(chunks: list[bytes]) -> list[dict]:
+    """解析 SSE 数据块"""
+    return [orjson.loads(chunk.removeprefix(b"data: ")) for chunk in chunks]
+
+
+async def test_sse_adapter_streams_frames_and_fills_cache():
+    team = CountingTeam()
+    scheduler = hat.TaskScheduler(team)
+
+    for _ in range(2):
+        chunks = [chunk async for chunk in sse_adapter(scheduler.receive_task("任务"), _request())]
+        frames = _decode(chunks)
+        assert frames[0]["type"] == "connection"
+        assert frames[-1]["type"] == "end"
+        assert sum(frame["type"] == "end" for frame in frames) == 1
+        assert all(chunk.endswith(b"\n\n") for chunk in chunks)
+
+    assert len(scheduler._frame_cache) == 1
+    assert team.runs == 1
+
+
+async def test_sse_adapter_appends_end_frame_when_source_has_none():
+    async def frames():
+        yield {"type": "result", "agent": "搜索专家", "message": "结果", "node": "searcher"}
+
+    decoded = _decode([chunk async for chunk in sse_adapter(frames(), _request())])
+    assert [frame["type"] for frame in decoded] == ["connection", "result", "end"]
+
+
+async def test_sse_adapter_reports_source_errors():
+    async def frames():
+        yield {"type": "result", "agent": "搜索专家", "message": "结果", "node": "searcher"}
+        raise RuntimeError("boom")
+
+    decoded = _decode([chunk async for chunk in sse_adapter(frames(), _request())])
+    assert [frame["type"] for frame in decoded] == ["connection", "result", "error", "end"]
+
+
+async def test_sse_adapter_closes_source_on_disconnect():
+    closed = asyncio.Event()
+
+    async def frames():
+        try:
+            while True:
+                yield {"type": "result", "agent": "搜索专家", "message": "结果", "node": "searcher"}
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    chunks = [chunk async for chunk in sse_adapter(frames(), _request(disconnected=True))]
+
+    assert closed.is_set()
+    assert all(frame["type"] != "end" for frame in _decode(chunks))
+
+
+async def test_sse_adapter_lets_source_finish_after_end_frame():
+    finished = False
+
+    async def frames():
+        nonlocal finished
+        yield {"type": "end", "agent": "系统", "message": "完成"}
+        yield {"type": "result", "agent": "系统", "message": "结束后的帧"}
+        finished = True
+
+    decoded = _decode([chunk async for chunk in sse_adapter(frames(), _request())])
+
+    assert finished
+    assert [frame["type"] for frame in decoded] == ["connection", "end"]
+
+
+async def test_sse_adapter_does_not_hold_a_receive_call_open():
+    pending = 0
+
+    async def receive():
+        nonlocal pending
+        pending += 1
+        try:
+            await asyncio.Event().wait()
+        finally:
+            pending -= 1
+
+    async def frames():
+        for _ in range(3):
+            yield {"type": "result", "agent": "搜索专家", "message": "结果", "node": "searcher"}
+            await asyncio.sleep(0)
+
+    request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+    async for _ in sse_adapter(frames(), request):
+        # StreamingResponse 自己的断开监听是 receive 通道唯一的阻塞消费者
+        assert pending == 0
+
+
+def test_format_sse_data_matches_compact_json_encoding():
+    frame = {"type": "result", "agent": "搜索专家", "message": "中文\n内容", "node": "searcher",
+             "timestamp": "t", "is_real_streaming": True}
+    chunk = format_sse_data(frame)
+
+    expected = json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+    assert chunk == f"data: {expected}\n\n".encode("utf-8")
+    assert b"\n" not in chunk[:-2]
+    assert orjson.loads(chunk[6:]) == frame
+
+
+@pytest.mark.parametrize("frame", [
+    {"type": "status", "agent": "主管", "message": "✅ 完成", "node": "supervisor", "timestamp": "t1"},
+    # 调度器帧由 _SCHEDULER_FRAME | {...} 构造，agent 与 node 在前
+    hat._SCHEDULER_FRAME | {"type": "thinking", "message": "📊 汇总执行结果...", "timestamp": "t1"},
+    # 时间戳不在最后时不走前缀缓存
+    {"timestamp": "t1", "type": "status", "agent": "主管", "message": "完成", "node": "supervisor"},
+])
+def test_format_sse_data_keeps_frame_key_order(frame):
+    expected = b"data: " + orjson.dumps(frame) + b"\n\n"
+
+    assert format_sse_data(frame) == expected
+    # 命中缓存的前缀后只有时间戳变化
+    assert format_sse_data(frame | {"timestamp": "t2"}) == expected.replace(b'"t1"', b'"t2"')
@@ -0,0 +1,141 @@
+"""主管路由"""
+
+from langchain_core.messages import HumanMessage
+from langgraph.graph import END
+
+import hierarchical_agent_teams as hat
+from conftest import FakeStructuredLLM
+
+MEMBERS = ["writer", "outline", "chart_generator"]
+SUPERVISOR_ID = ",".join(MEMBERS)
+
+
+class FakeRouterLLM:
+    """支持 with_structured_output 的假路由模型，记录绑定次数与绑定参数"""
+
+    def __init__(self, *responses):
+        self.router = FakeStructuredLLM(*responses)
+        self.bindings = 0
+        self.kwargs = {}
+
+    def with_structured_output(self, schema, **kwargs):
+        self.bindings += 1
+        self.kwargs = kwargs
+        return self.router
+
+
+def _state(*names, route_history=()):
+    messages = [HumanMessage(content="写一份报告")]
+    messages += [HumanMessage(content=f"{name} 已完成", name=name) for name in names]
+    return {"messages": messages, "route_history": list(route_history)}
+
+
+async def test_routes_to_selected_member():
+    llm = FakeRouterLLM({"next": "outline"}, {"next": "writer"})
+    supervisor = hat.make_supervisor_node(llm, MEMBERS)
+
+    command = await supervisor(_state())
+    assert command.goto == "outline"
+    assert command.update["route_history"] == [(SUPERVISOR_ID, "outline", 1)]
+    assert (await supervisor(_state("outline"))).goto == "writer"
+    # 结构化输出只在创建主管时绑定一次
+    assert llm.bindings == 1
+
+
+def test_router_binds_strict_json_schema():
+    llm = FakeRouterLLM({"next": "FINISH"})
+    hat.make_supervisor_node(llm, MEMBERS)
+
+    assert llm.kwargs["method"] == "json_schema"
+    assert llm.kwargs["strict"] is True
+
+
+async def test_routes_to_parallel_targets():
+    supervisor = hat.make_supervisor_node(FakeRouterLLM({"next": ["outline", "chart_generator", "outline"]}), MEMBERS)
+    command = await supervisor(_state())
+
+    assert command.goto == ["outline", "chart_generator"]
+    assert command.update["next"] == "outline,chart_generator"
+    assert command.update["route_history"] == [(SUPERVISOR_ID, "outline,chart_generator", 1)]
+
+
+async def test_finish_ends_the_run():
+    supervisor = hat.make_supervisor_node(FakeRouterLLM({"next": "FINISH"}), MEMBERS)
+    command = await supervisor(_state("writer"))
+    assert command.goto == END
+
+
+async def test_missing_next_field_falls_back_to_finish():
+    supervisor = hat.make_supervisor_node(FakeRouterLLM({"unexpected": "value"}), MEMBERS)
+    command = await supervisor(_state())
+    assert command.goto == END
+
+
+def test_router_schema_shared_per_member_tuple():
+    assert hat._get_router(tuple(MEMBERS)) is hat._get_router(tuple(MEMBERS))
+    assert hat._get_router(tuple(MEMBERS)) is not hat._get_router(("writer",))
+
+
+async def test_auto_finish_skips_llm_once_all_members_ran():
+    llm = FakeRouterLLM({"next": "writer"})
+    supervisor = hat.make_supervisor_node(llm, MEMBERS, auto_finish=True)
+
+    command = await supervisor(_state(*MEMBERS))
+
+    assert command.goto == END
+    assert llm.router.calls == 0
+
+
+async def test_repeated_route_without_progress_is_stopped():
+    supervisor = hat.make_supervisor_node(FakeRouterLLM({"next": "writer"}), MEMBERS)
+    stuck = (SUPERVISOR_ID, "writer", 1)
+
+    command = await supervisor(_state(route_history=[stuck] * (hat.MAX_REPEATED_ROUTES - 1)))
+    assert command.goto == END
+    assert command.update["next"] == END
+
+
+async def test_non_consecutive_loop_is_stopped_after_max_visits():
+    supervisor = hat.make_supervisor_node(FakeRouterLLM({"next": ["writer"]}), MEMBERS)
+    history = [(SUPERVISOR_ID, "writer", 1), (SUPERVISOR_ID, "outline", 2), (SUPERVISOR_ID, "writer", 3)]
+    command = await supervisor(_state("writer", "outline", "writer", route_history=history))
+    assert command.goto == END
+
+    # 未达到访问上限时正常路由
+    command = await supervisor(_state("writer", route_history=history[:1]))
+    assert command.goto == "writer"
+
+
+async def test_router_sees_task_summary_and_latest_message_only():
+    llm = FakeRouterLLM({"next": "writer"})
+    supervisor = hat.make_supervisor_node(llm, MEMBERS)
+    state = _state("outline", "chart_generator") | {"summary": "outline: 大纲\nchart_generator: 图表"}
+
+    await supervisor(state)
+
+    system, task, summary, latest = llm.router.last_input
+    assert system["role"] == "system"
+    assert task is state["messages"][0]
+    assert summary["content"].endswith(state["summary"])
+    assert latest is state["messages"][-1]
+
+
+async def test_route_cache_embeds_task_and_matches_progress(monkeypatch):
+    texts = []
+
+    class FakeEmbeddings:
+        async def aembed_query(self, text):
+            texts.append(text)
+            return [1.0, 0.0]
+
+    monkeypatch.setattr(hat, "embeddings", FakeEmbeddings())
+    llm = FakeRouterLLM({"next": "outline"}, {"next": "writer"})
+    supervisor = hat.make_supervisor_node(llm, MEMBERS, route_cache=True)
+
+    assert (await supervisor(_state())).goto == "outline"
+    assert (await supervisor(_state("outline"))).goto == "writer"
+    # 相同任务、相同进度命中缓存，不再调用 LLM
+    assert (await supervisor(_state("outline"))).goto == "writer"
+
+    assert texts == ["写一份报告"] * 3
+    assert llm.router.calls == 2
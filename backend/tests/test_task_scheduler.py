@@ -0,0 +1,128 @@
+"""TaskScheduler 的任务结果缓存"""
+
+import pytest
+
+import hierarchical_agent_teams as hat
+from conftest import CountingTeam
+
+
+async def _until_end(generator):
+    """模拟 SSE 消费端：收到结束帧即停止迭代"""
+    frames = []
+    async for frame in generator:
+        frames.append(frame)
+        if frame["type"] == "end":
+            break
+    await generator.aclose()
+    return frames
+
+
+def test_create_task_scheduler_requires_team():
+    with pytest.raises(ValueError):
+        hat.create_task_scheduler(None)
+
+
+async def test_cache_hit_replays_frames_without_running_graph():
+    team = CountingTeam()
+    scheduler = hat.TaskScheduler(team)
+
+    first = [frame async for frame in scheduler.receive_task("任务")]
+    second = [frame async for frame in scheduler.receive_task("任务")]
+
+    assert team.runs == 1
+    assert [f["type"] for f in first] == [f["type"] for f in second]
+    assert [f["message"] for f in first] == [f["message"] for f in second]
+    assert first[-1]["type"] == "end"
+
+
+async def test_cache_filled_when_consumer_stops_at_end():
+    team = CountingTeam()
+    scheduler = hat.TaskScheduler(team)
+
+    await _until_end(scheduler.receive_task("任务"))
+    assert len(scheduler._frame_cache) == 1
+
+    await _until_end(scheduler.receive_task("任务"))
+    assert team.runs == 1
+
+
+async def test_cache_entry_expires_after_ttl(monkeypatch):
+    team = CountingTeam()
+    scheduler = hat.TaskScheduler(team)
+    now = [1000.0]
+    monkeypatch.setattr(hat.time, "monotonic", lambda: now[0])
+
+    [frame async for frame in scheduler.receive_task("任务")]
+    now[0] += hat.HAT_CACHE_TTL + 1
+    [frame async for frame in scheduler.receive_task("任务")]
+
+    assert team.runs == 2
+
+
+async def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(hat, "HAT_CACHE_SIZE", 2)
+    scheduler = hat.TaskScheduler(CountingTeam())
+
+    for task in ("a", "b", "a", "c"):
+        [frame async for frame in scheduler.receive_task(task)]
+
+    assert len(scheduler._frame_cache) == 2
+    assert scheduler._cache_get(scheduler._cache_key("a", True)) is not None
+    assert scheduler._cache_get(scheduler._cache_key("b", True)) is None
+
+
+async def test_cache_disabled_when_size_is_zero(monkeypatch):
+    monkeypatch.setattr(hat, "HAT_CACHE_SIZE", 0)
+    team = CountingTeam()
+    scheduler = hat.TaskScheduler(team)
+
+    for _ in range(2):
+        [frame async for frame in scheduler.receive_task("任务")]
+
+    assert team.runs == 2
+    assert not scheduler._frame_cache
+
+
+async def test_error_results_are_not_cached():
+    team = CountingTeam({"type": "error", "agent": "系统", "message": "出错", "node": "searcher"})
+    scheduler = hat.TaskScheduler(team)
+
+    for _ in range(2):
+        await _until_end(scheduler.receive_task("任务"))
+
+    assert team.runs == 2
+    assert not scheduler._frame_cache
+
+
+async def test_runs_without_results_are_not_cached():
+    team = CountingTeam({"type": "status", "agent": "搜索专家", "message": "完成", "node": "searcher"})
+    scheduler = hat.TaskScheduler(team)
+
+    for _ in range(2):
+        await _until_end(scheduler.receive_task("任务"))
+
+    assert team.runs == 2
+    assert not scheduler._frame_cache
+
+
+async def test_execute_sync_joins_tokens_per_node(fake_final_llm, fake_planner):
+    fake_planner({"agent": "searcher", "depends_on": []})
+    scheduler = hat.TaskScheduler(hat.create_agent_team())
+
+    result = await scheduler.execute_sync("调研 AI 智能体")
+
+    assert result["success"] is True
+    assert result["result"] == "假 模型 输出"
+
+
+async def test_execute_sync_reports_and_does_not_cache_worker_failure(failing_final_llm, fake_planner):
+    planner = fake_planner({"agent": "searcher", "depends_on": []})
+    scheduler = hat.TaskScheduler(hat.create_agent_team())
+
+    for _ in range(2):
+        result = await scheduler.execute_sync("调研 AI 智能体")
+        assert result["success"] is False
+        assert any(step["type"] == "error" and step["node"] == "searcher" for step in result["steps"])
+
+    assert planner.calls == 2
+    assert not scheduler._frame_cache
@@ -0,0 +1,26 @@
+"""时间戳工具"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import timeutil
+
+
+def test_now_iso_formats_once_per_millisecond(monkeypatch):
+    now = [1_700_000_000_123_456_789]
+    monkeypatch.setattr(timeutil.time, "time_ns", lambda: now[0])
+
+    first = timeutil.now_iso()
+    now[0] += 500_000  # 同一毫秒内
+    assert timeutil.now_iso() is first
+    assert first == "2023-11-14T22:13:20.123+00:00"
+
+    now[0] += 1_000_000
+    assert timeutil.now_iso() == "2023-11-14T22:13:20.124+00:00"
+
+
+def test_streaming_does_not_import_agent_module():
+    # 新进程中导入，避免受本进程已加载模块的影响
+    code = "import sys, streaming; assert 'hierarchical_agent_teams' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parent.parent, check=True)
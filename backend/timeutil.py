@@ -0,0 +1,27 @@
+"""
+时间戳工具模块
+
+只依赖标准库，供智能体团队与 SSE 流式模块共同使用，
+streaming 不必为了时间戳导入整个智能体模块（及其模型客户端和图）。
+"""
+
+import time
+from datetime import datetime, timezone
+
+
+# 最近一次格式化的 (毫秒时间戳, ISO 字符串)
+_last_iso: tuple[int, str] = (0, "")
+
+
+def now_iso() -> str:
+    """
+    当前 UTC 时间（ISO 8601，毫秒精度），便于客户端按时间戳度量首包延迟
+
+    同一毫秒内的多个帧复用上一次格式化的结果，token 密集时不再逐帧格式化。
+    """
+    global _last_iso
+    ms = time.time_ns() // 1_000_000
+    if ms != _last_iso[0]:
+        stamp = datetime.fromtimestamp(ms // 1000, timezone.utc).replace(microsecond=ms % 1000 * 1000)
+        _last_iso = (ms, stamp.isoformat(timespec="milliseconds"))
+    return _last_iso[1]